@@ -0,0 +1,31 @@
+"""Precompute the transit node paths of a map for the optimized pathfinder."""
+
+import argparse
+import json
+from pathlib import Path
+
+from loguru import logger
+
+from simulation.pathing import OptimizedPathfinder
+from utilities.logging import configure_logger
+from utilities.paths import PATHS
+from utilities.types.scenario import ScenarioSpec
+
+if __name__ == '__main__':
+    configure_logger('TRACE')
+    parser = argparse.ArgumentParser(prog='Loc-ABS', description='Optimized pathfinder builder.')
+    parser.add_argument('config', type=Path, help='Run config of the map, with its transit nodes.')
+    parser.add_argument('--workers', type=int, help='Number of worker processes, the number of CPUs by default.')
+    parser.add_argument('--legacy', action='store_true', help='Convert the paths saved by earlier versions instead.')
+    args = parser.parse_args()
+
+    sim = ScenarioSpec.from_dict(json.loads(args.config.read_text())['scenario']).sim
+    name = OptimizedPathfinder.map_name(sim.mapfile)
+    if not args.legacy:
+        OptimizedPathfinder.build(sim, args.workers).save(name)
+    elif (legacy := OptimizedPathfinder.legacy_file(name)) is not None:
+        logger.debug(f'Converting the paths of {legacy}...')
+        OptimizedPathfinder.from_legacy(legacy, sim.shape).save(name)
+    else:
+        raise FileNotFoundError(f'No paths of {sim.mapfile} saved by earlier versions in {PATHS}.')
+    logger.success(f'Paths of {sim.mapfile} saved to {OptimizedPathfinder.file(name)}.')
@@ -13,13 +13,17 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(prog='Loc-ABS', description='Main simulation launcher.')
     parser.add_argument('--profile', action='store_true', help='Enable profiling.')
     parser.add_argument('--manual', action='store_true', help='Use manual launch config.')
+    parser.add_argument('--resume', type=int, metavar='RUN_ID', help='Resume an interrupted run from its checkpoints.')
     args = parser.parse_args()
 
-    launch_config = {'config': CFG / 'bsf.json', 'runs': 1} if args.manual else LauncherCLI().prompt()
-    launcher = SimLauncher.from_config(**launch_config)
+    if args.resume is not None:
+        launcher = SimLauncher(args.resume)
+    else:
+        launch_config = {'config': CFG / 'bsf.json', 'runs': 1} if args.manual else LauncherCLI().prompt()
+        launcher = SimLauncher.from_config(**launch_config)
 
     if args.profile:
         profiler = Profiler(launcher.run.logfile, module=['/backend/'])
-        profiler.profile(launcher.start)
+        profiler.profile(launcher.start, resume=args.resume is not None)
     else:
-        launcher.start()
+        launcher.start(resume=args.resume is not None)
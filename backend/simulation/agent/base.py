@@ -1,8 +1,8 @@
 """Base agent class for simulation."""
 
 from abc import ABC, abstractmethod
-from collections import deque
 from random import random
+from typing import Self
 
 import numpy as np
 
@@ -20,20 +20,30 @@ class BaseAgent(ABC):
         scenario: Scenario instance from simulation.scenario module.
         state: The infection state of the person.
         info: The agent's information.
+        schedule: The agent's schedule keyed on minute of the day.
+        zone_ids: Zone ids of the agent's `HOME`, `WORK` and `EXIT` zones, `-1` if undefined.
         random: Numpy random number generator instance.
     """
 
-    def __init__(self, scenario: BaseScenario, spec: AgentSpec) -> None:
+    def __init__(self, scenario: BaseScenario, spec: AgentSpec, rng: np.random.Generator | None = None) -> None:
         """Initialize the agent with a scenario and agent specification.
 
         Args:
             scenario: Scenario instance from simulation.scenario module.
             spec: AgentSpec instance from simulation.types.agent module.
+            rng: Numpy random number generator, possibly shared between agents.
         """
         self.scenario = scenario
-        self.random = np.random.default_rng()
+        self.random = rng if rng is not None else np.random.default_rng()
         self.state = spec.state
         self.info = spec.info
+        self.schedule = self.info.compile_schedule()
+        sim = self.scenario.sim
+        self.zone_ids = {
+            'HOME': sim.zone_id(self.info.home_zone),
+            'WORK': sim.zone_id(self.info.work_zone),
+            'EXIT': sim.zone_id('EXIT'),
+        }
 
         if self.is_(UNKNOWN):
             if random() < self.scenario.virus.infection_rate:
@@ -44,6 +54,28 @@ class BaseAgent(ABC):
         if self.info.start_zone:
             self.state.pos = self.scenario.get_idx(self.info.start_zone)
 
+    @classmethod
+    def create_many(cls, scenario: BaseScenario, spec: AgentSpec, n: int, rng: np.random.Generator) -> list[Self]:
+        """Instantiate `n` agents from a validated specification, drawing their attributes in batches.
+
+        Args:
+            scenario: Scenario instance from simulation.scenario module.
+            spec: Validated specification shared by the agents.
+            n: Number of agents to instantiate.
+            rng: Numpy random number generator shared by the agents.
+        """
+        urgency = rng.uniform(0.75, 0.99, n).tolist()
+        attributes = cls.sample_attributes(rng, n)
+        return [
+            cls(scenario, spec.copy(urgency=urgency[i]), rng, **{k: v[i] for k, v in attributes.items()})
+            for i in range(n)
+        ]
+
+    @classmethod
+    def sample_attributes(cls, rng: np.random.Generator, n: int) -> dict[str, list]:
+        """Draw subclass specific constructor arguments for `n` agents."""
+        return {}
+
     @property
     def dt(self) -> AgentTime:
         """Get the current time step of the agent."""
@@ -51,13 +83,8 @@ class BaseAgent(ABC):
 
     def in_(self, zone: str) -> bool:
         """Check whether agent is in `zone`."""
-        match zone:
-            case 'WORK':
-                zone = self.info.work_zone
-            case 'HOME':
-                zone = self.info.home_zone
-
-        return self.scenario.sim.masks[zone][self.state.pos]
+        zone_id = self.zone_ids[zone] if zone in self.zone_ids else self.scenario.sim.zone_id(zone)
+        return zone_id >= 0 and bool(self.scenario.sim.in_zone(zone_id, self.state.pos))
 
     def is_(self, status: AgentStatus) -> bool:
         """Check whether agent status is `status`."""
@@ -65,9 +92,9 @@ class BaseAgent(ABC):
 
     def check_schedule(self) -> None:
         """Check whether a task is scheduled for the current time."""
-        action = self.info.schedule.get(self.scenario.now)
-        if action and self.dt.last_action_time != self.scenario.now:
-            self.dt.last_action_time = self.scenario.now
+        action = self.schedule.get(self.scenario.now)
+        if action and self.dt.last_action_time != self.scenario.minute:
+            self.dt.last_action_time = self.scenario.minute
             self.set_task(action)
 
     def set_task(self, zone: str | None = None, wait: int = 0) -> None:
@@ -78,7 +105,8 @@ class BaseAgent(ABC):
             wait: The number of time steps to wait before moving.
         """
         if wait > 0:
-            self.state.path = deque([self.state.pos] * wait)
+            self.state.path = None
+            self.state.wait = wait
         elif zone is not None:
             match zone:
                 case 'WORK':
@@ -94,16 +122,33 @@ class BaseAgent(ABC):
             else:
                 wait_time = 3600 // self.scenario.sim.t_step  # seconds
 
-            wait_time = int(wait_time * (1 + random()) * 0.5)
-            self.state.path += [self.state.path[-1]] * wait_time
+            self.state.wait = int(wait_time * (1 + random()) * 0.5)
 
     def pathfind(self, idx: tuple[int, int, int]) -> None:
-        """Computes the shortest path between two coordinates.
+        """Requests the shortest path between two coordinates, computed with the other requests of the time step.
 
         Args:
             idx: `(x,y,z)` coordinate tuple to path to.
         """
-        self.state.path = self.scenario.graph.pathfind(self.state.pos, idx)
+        self.scenario.request_path(self.state, idx)
+
+    def follow_path(self) -> bool:
+        """Move one step along the current path or wait out the current task.
+
+        Returns:
+            busy: Whether the agent had a path step or wait to consume.
+        """
+        state = self.state
+        if state.path is not None:
+            state.pos = self.scenario.to_coord(state.path[state.cursor])
+            state.cursor += 1
+            if state.cursor == len(state.path):
+                state.path = None
+            return True
+        elif state.wait > 0:
+            state.wait -= 1
+            return True
+        return False
 
     @abstractmethod
     def move(self) -> None:
@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import json
 import os
 import pickle
 import tempfile
@@ -10,6 +11,7 @@ from queue import Queue
 from threading import Event
 
 import django
+import numpy as np
 from dask.distributed import Client, wait
 from django.db import connections
 from loguru import logger
@@ -51,14 +53,35 @@ class SimLauncher:
 
         return cls(run)
 
-    def start(self) -> None:
-        """Start the simulation run."""
+    @property
+    def branches(self) -> dict:
+        """What-if branches of the run from the `branches` entry of its configuration, if any.
+
+        The `variants` keyed on name share the first `at` iterations of each run, and each
+        overrides scenario parameters from then on, see `SIRModel.apply_variant`.
+        """
+        return json.loads((BACKEND / self.run.config).read_text()).get('branches', {})
+
+    @property
+    def ensemble(self) -> int:
+        """Number of runs simulated together by each task of `run_parallel`, `sim.ensemble` of the configuration."""
+        return json.loads((BACKEND / self.run.config).read_text())['scenario']['sim'].get('ensemble', 1)
+
+    def start(self, resume: bool = False) -> None:
+        """Start the simulation run.
+
+        Multiple, branched and ensemble runs are simulated by `run_parallel`, single runs by `run_sim`.
+
+        Args:
+            resume: Resume the simulations of an interrupted run from their latest checkpoints.
+        """
+        parallel = self.run.runs > 1 or self.branches or self.ensemble > 1
         self.set_status(Run.Status.RUNNING)
         with Redirector(self.run.logfile):
             try:
                 logger.debug(f'Writing outputs to >> {self.run.save_dir}/*.hdf5')
                 logger.debug(f'Logging to >> {self.run.logfile}')
-                self.run_parallel() if self.run.runs > 1 else self.run_sim()
+                self.run_parallel(resume) if parallel else self.run_sim(resume)
                 self.set_status(Run.Status.SUCCESS)
             except Exception:
                 self.set_status(Run.Status.FAILURE)
@@ -68,23 +91,30 @@ class SimLauncher:
         """Set the status of the run."""
         Run.objects.filter(id=self.run.id).update(status=status)
 
-    def run_sim(self) -> None:
+    def run_sim(self, resume: bool = False) -> None:
         """Launch a single simulation run using threads."""
         logger.debug('Loading model assets...')
         model = SIRModel(BACKEND / self.run.config)
         outfile = self.run.save_dir / '0.hdf5'
+        checkpoint = model.checkpoint_file(outfile)
+
+        start = 0
+        if resume and checkpoint.exists():
+            start, _ = model.load_checkpoint(checkpoint)
+            logger.debug(f'Resuming simulation from iteration {start}...')
 
         try:
             logger.debug('Starting simulation|publisher|writer threads...')
             terminate = Event()
             (publisher := PublisherThread(target=Publisher().publish, args=(pub_queue := Queue(), terminate))).start()
-            (simulation := SimulationThread(target=model.simulate, args=(pub_queue,))).start()
-            (writer := WriterThread(target=Writer(outfile, model.sim.max_iter).write, args=(terminate,))).start()
+            (simulation := SimulationThread(target=model.simulate, args=(pub_queue, checkpoint, start))).start()
+            (writer := WriterThread(target=Writer(outfile, model.sim.max_iter, start).write, args=(terminate,))).start()
 
             simulation.join()
             logger.debug('Simulation finished, waiting for publisher|writer threads...')
             publisher.join()
             writer.join()
+            checkpoint.unlink(missing_ok=True)
             logger.success(f'Simulation results saved to {outfile}.')
         except Exception:
             logger.error('Simulation failed, sending termination signal to threads...')
@@ -96,32 +126,131 @@ class SimLauncher:
                 if thread.is_alive():
                     logger.warning(f'Thread {thread.name} is still alive after 1 second.')
 
-    def run_parallel(self) -> None:
-        """Parallelize multiple simulation runs using Dask."""
+    def run_parallel(self, resume: bool = False) -> None:
+        """Parallelize multiple simulation runs using Dask, `sim.ensemble` runs per task.
+
+        The last task of each save directory only simulates the runs that remain, with a model of as many replicates.
+        When resuming, tasks whose outputs are complete are skipped and the others continue from their checkpoints.
+
+        Branched runs simulate the iterations shared by their variants once, then every variant of a run
+        continues from it with the same new random states and writes to `save_dir/<variant>/<run>.hdf5`.
+        Resumed runs continue from the same shared iterations and random states, see `_warm_start`.
+        """
         logger.debug(f'Configuring {self.run.runs} runs for {self.run.name} (id={self.run.id})...')
 
         with Client(f'tcp://{HOST}:8786', direct_to_workers=True) as client:
             logger.success(f'Dask cluster dashboard - {client.dashboard_link}')
 
-            filenames = [self.run.save_dir / f'{run}.hdf5' for run in range(self.run.runs)]
-            if any(f.exists() for f in filenames):
+            branches = self.branches
+            variants: dict[str | None, dict | None] = branches.get('variants') or {None: None}
+            save_dirs = {name: self.run.save_dir if name is None else self.run.save_dir / name for name in variants}
+            filenames = {name: [d / f'{run}.hdf5' for run in range(self.run.runs)] for name, d in save_dirs.items()}
+            if not resume and any(f.exists() for files in filenames.values() for f in files):
                 raise FileExistsError(f'Output files already exist in {self.run.save_dir}')
+            for d in save_dirs.values():
+                (BACKEND / d).mkdir(parents=True, exist_ok=True)
+
+            size = self.ensemble
+            batches, indices, overrides = [], [], []
+            for name, files in filenames.items():
+                for b, batch in enumerate(files[i : i + size] for i in range(0, len(files), size)):
+                    if resume and all(f.exists() for f in batch) and not SIRModel.checkpoint_file(batch[0]).exists():
+                        continue
+                    batches.append(batch)
+                    indices.append(b)
+                    overrides.append(variants[name])
+            if resume:
+                logger.debug(f'Resuming {len(batches)} unfinished tasks...')
 
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pkl', prefix='SIRModel', dir=TMP) as f:
-                model = SIRModel(self.run.config)
-                pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
-                model_pkl = Path(f.name).relative_to(TMP)
+            # one model per number of replicates, the full ensemble and that of the last tasks
+            models = {n: self._prepare_model(n, n != size, branches, resume) for n in sorted(set(map(len, batches)))}
+            model_pkls = [models[len(batch)][0] for batch in batches]
+            warm_starts = [models[len(batch)][1] for batch in batches]
+            seeds = [[models[len(batch)][2], b] if branches else None for batch, b in zip(batches, indices)]
 
             job_id = f'{self.run.id:03}-{self.run.name}'
-            res = client.map(self._parallel_helper, filenames, model_pkl=model_pkl, pure=False, key=job_id)
+            args = (batches, seeds, overrides, model_pkls, warm_starts)
+            res = client.map(self._parallel_helper, *args, resume=resume, pure=False, key=job_id)
             logger.debug('Simulation runs submitted to scheduler, waiting for completion...')
             wait(res)
+            if failed := sum(future.status != 'finished' for future in res):
+                # the shared iterations are kept for the unfinished runs to resume from
+                raise RuntimeError(f'{failed} of {len(res)} simulation tasks failed.')
+            for _, warm_start, _ in models.values():
+                if warm_start is not None:
+                    (BACKEND / warm_start).unlink(missing_ok=True)
+                    (BACKEND / warm_start).with_suffix('.json').unlink(missing_ok=True)
             logger.success('All simulation runs completed successfully.')
 
-    def _parallel_helper(self, outfile: Path, model_pkl: Path) -> None:
-        """Callable for Dask."""
+    def _prepare_model(
+        self, ensemble: int, partial: bool, branches: dict, resume: bool
+    ) -> tuple[Path, Path | None, int]:
+        """Pickle the model of the tasks of `run_parallel` simulating `ensemble` runs and warm start it.
+
+        Args:
+            ensemble: Number of runs simulated together by the tasks.
+            partial: Whether the tasks only simulate the runs that remain after the full ensembles.
+            branches: What-if branches of the run, see `branches`.
+            resume: Resume from the iterations shared by every run, if already simulated.
+
+        Returns:
+            model_pkl: Pickled model relative to `TMP`.
+            warm_start: Checkpoint of the shared iterations relative to `BACKEND`, `None` if there are none.
+            entropy: Entropy of the seeds of the branches.
+        """
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.pkl', prefix='SIRModel', dir=TMP) as f:
+            model = SIRModel(self.run.config, ensemble=ensemble)
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+            model_pkl = Path(f.name).relative_to(TMP)
+        return model_pkl, *self._warm_start(model, branches, resume, tag=f'-{ensemble}' if partial else '')
+
+    def _warm_start(
+        self, model: SIRModel, branches: dict, resume: bool = False, tag: str = ''
+    ) -> tuple[Path | None, int]:
+        """Simulate the iterations shared by every run of `run_parallel`, unless resuming from them.
+
+        The checkpoint of the trunk of branched runs or of the burn-in is kept in the save directory,
+        with the entropy of the seeds of the branches, until every run is complete. Tasks simulating
+        fewer replicates than the others warm start from their own checkpoint, tagged with `tag`.
+
+        Returns:
+            warm_start: Checkpoint of the shared iterations relative to `BACKEND`, `None` if there are none.
+            entropy: Entropy of the seeds of the branches.
+        """
+        if branches:
+            n_iter, warm_start = branches['at'], self.run.save_dir / f'trunk{tag}.ckpt'
+        elif model.sim.burn_in:
+            n_iter, warm_start = model.sim.burn_in, self.run.save_dir / f'burn-in{tag}.ckpt'
+        else:
+            return None, np.random.SeedSequence().entropy
+
+        seeds = BACKEND / warm_start.with_suffix('.json')
+        if resume and (BACKEND / warm_start).exists() and seeds.exists():
+            logger.debug(f'Resuming from the {n_iter} iterations shared by every run in {warm_start}...')
+            return warm_start, json.loads(seeds.read_text())['entropy']
+
+        logger.debug(f'Simulating {n_iter} iterations shared by every run...')
+        model.burn_in(BACKEND / warm_start, n_iter)
+        # branches of the same runs draw the same random numbers, so they only differ by their variant
+        entropy = np.random.SeedSequence().entropy
+        seeds.write_text(json.dumps({'entropy': entropy}))
+        return warm_start, entropy
+
+    def _parallel_helper(
+        self,
+        outfiles: list[Path],
+        seed: list[int] | None,
+        variant: dict | None,
+        model_pkl: Path,
+        warm_start: Path | None = None,
+        resume: bool = False,
+    ) -> None:
+        """Callable for Dask, warm starting from the burn-in or trunk checkpoint `warm_start` relative to `BACKEND`."""
         if isinstance(model_pkl, Path):
             model: SIRModel = pickle.loads((TMP / model_pkl).read_bytes())
+        model.reseed()  # unpickled generators share their state
 
         with Redirector(self.run.logfile):
-            model.simulate_fast(BACKEND / outfile)
+            outfiles = [BACKEND / outfile for outfile in outfiles]
+            warm_start = None if warm_start is None else BACKEND / warm_start
+            model.simulate_fast(outfiles, resume=resume, warm_start=warm_start, seed=seed, variant=variant)
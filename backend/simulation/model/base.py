@@ -1,18 +1,51 @@
 """Tools for managing execution of the simulation."""
 
+import copy
+import io
 import json
+import pickle
+import random
 from abc import ABC, abstractmethod
+from collections import defaultdict
 from pathlib import Path
+from typing import IO, Any, override
 
 import numpy as np
 
 from simulation.agent import BaseAgent
+from simulation.population import BasePopulation
 from simulation.scenario import BaseScenario
 from utilities.paths import BACKEND
 from utilities.types.agent import AgentSpec
 from utilities.types.scenario import ScenarioSpec
 
 
+class _CheckpointPickler(pickle.Pickler):
+    """Pickler saving references to the model scenario in place of the scenario itself."""
+
+    @override
+    def __init__(self, file: IO[bytes], scenario: BaseScenario) -> None:
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.scenario = scenario
+
+    @override
+    def persistent_id(self, obj: Any) -> str | None:
+        return 'scenario' if obj is self.scenario else None
+
+
+class _CheckpointUnpickler(pickle.Unpickler):
+    """Unpickler resolving references to the scenario saved by `_CheckpointPickler`."""
+
+    @override
+    def __init__(self, file: IO[bytes], scenario: BaseScenario) -> None:
+        super().__init__(file)
+        self.scenario = scenario
+
+    @override
+    def persistent_load(self, pid: str) -> BaseScenario:
+        return self.scenario
+
+
 class BaseModel(ABC):
     """Base Model class for simulation.
 
@@ -20,27 +53,56 @@ class BaseModel(ABC):
         scenario: Scenario object for the simulation.
         sim: Simulation object for the scenario.
         population: List of agents in the simulation.
+        schedule_index: Agents with a scheduled action keyed on minute of the day.
+        engine: Struct-of-arrays population backend, `None` when agents are stepped individually.
+        random: Random number generator shared by the agents.
     """
 
     population: list[BaseAgent]
+    engine: BasePopulation | None
 
-    def __init__(self, config: Path, agent_cls: type[BaseAgent], scenario_cls: type[BaseScenario]) -> None:
+    def __init__(
+        self,
+        config: Path,
+        agent_cls: type[BaseAgent],
+        scenario_cls: type[BaseScenario],
+        population_cls: type[BasePopulation] | None = None,
+        ensemble: int | None = None,
+    ) -> None:
         """Initialize the model from a configuration file.
 
         Args:
             config: Path to the configuration file.
             agent_cls: Class of the agent to be used in the simulation.
             scenario_cls: Class of the scenario to be used in the simulation.
+            population_cls: Class of the vectorized population backend, used when `sim.vectorized` is set.
+            ensemble: Number of replicates simulated together, overriding `sim.ensemble` of the configuration.
         """
         try:
             cfg = json.loads(config.read_text())  # TODO: use a dataclass
         except FileNotFoundError:
             cfg = json.loads(BACKEND / config.read_text())
+        if ensemble is not None:
+            cfg['scenario']['sim']['ensemble'] = ensemble
 
         self.scenario: BaseScenario = scenario_cls(ScenarioSpec.from_dict(cfg['scenario']))
         self.sim = self.scenario.sim
 
-        self.create_agents(cfg['agents'], agent_cls)
+        if self.sim.ensemble > 1 and (not self.sim.vectorized or population_cls is None):
+            raise ValueError('Ensembles require the struct-of-arrays population backend.')
+
+        agents = []
+        for _ in range(self.sim.ensemble):
+            self.create_agents(cfg['agents'], agent_cls)
+            agents += self.population
+        self.population = agents
+
+        self.engine = None
+        if self.sim.vectorized and population_cls is not None:
+            self.engine = population_cls(self.scenario, self.population)
+            self.population = []
+
+        self.schedule_index = self.index_schedules()
 
     def create_agents(self, config: dict, agent_cls: type[BaseAgent]) -> None:
         """Instantiate agents from configuration file.
@@ -49,29 +111,149 @@ class BaseModel(ABC):
             config: Dictionary containing agent specifications.
             agent_cls: Class of the agent to be used in the simulation.
         """
-        self.population: list[BaseAgent] = []
-        for _ in range(config['random_agents']):
-            spec = config['default'].copy()
-            spec['info']['urgency'] = np.random.uniform(0.75, 0.99)
-            agent = agent_cls(self.scenario, AgentSpec.from_dict(spec))
-            self.population.append(agent)
+        self.random = rng = np.random.default_rng()
+        default = AgentSpec.from_dict(config['default'])
+        self.population: list[BaseAgent] = agent_cls.create_many(self.scenario, default, config['random_agents'], rng)
 
         for i in range(config['random_infected']):
             self.population[i].infect()
 
         for custom_agent in config['custom']:
-            spec = config['default'].copy()
+            spec = copy.deepcopy(config['default'])
             for key, val in custom_agent.items():
                 spec[key].update(val)
-            agent = agent_cls(self.scenario, AgentSpec.from_dict(spec))
+            agent = agent_cls(self.scenario, AgentSpec.from_dict(spec), rng)
             self.population.append(agent)
 
-    def get_agents(self) -> np.ndarray:
-        """Get position and status of all agents."""
-        ret = []
+    @staticmethod
+    def checkpoint_file(outfile: Path) -> Path:
+        """Path of the checkpoint of the run writing to `outfile`."""
+        return outfile.with_suffix('.ckpt')
+
+    @staticmethod
+    def frames_file(checkpoint: Path) -> Path:
+        """Path of the frames saved incrementally alongside `checkpoint`, rather than in it."""
+        return checkpoint.with_suffix('.frames.npy')
+
+    def dump_checkpoint(self, n_iter: int, outputs: dict[str, np.typing.NDArray] | None = None) -> bytes:
+        """Serialize the dynamic state of the model.
+
+        The checkpoint holds the agents, the scenario clock, timeline and virus field, and the random
+        number generator states, but not the static map, pathfinding graph and configuration, which
+        are rebuilt from the run configuration on resume.
+
+        Args:
+            n_iter: Number of iterations saved so far.
+            outputs: Saved frames to restore with the model, trimmed to `n_iter` along their iteration axis.
+        """
+        state = {
+            'n_iter': n_iter,
+            'scenario': self.scenario.get_state(),
+            'population': self.population,
+            'engine': self.engine,
+            'random': {'numpy': np.random.get_state(), 'python': random.getstate(), 'model': self.random},
+            'outputs': outputs,
+        }
+        buffer = io.BytesIO()
+        _CheckpointPickler(buffer, self.scenario).dump(state)
+        return buffer.getvalue()
+
+    def save_checkpoint(self, path: Path, n_iter: int, outputs: dict[str, np.typing.NDArray] | None = None) -> None:
+        """Save the dynamic state of the model, replacing the previous checkpoint at `path` atomically.
+
+        Args:
+            path: Path of the checkpoint file.
+            n_iter: Number of iterations saved so far.
+            outputs: Saved frames to restore with the model, trimmed to `n_iter` along their iteration axis.
+        """
+        tmp = path.with_name(f'{path.name}.tmp')
+        tmp.write_bytes(self.dump_checkpoint(n_iter, outputs))
+        tmp.replace(path)
+
+    def reseed(self, seed: int | None = None) -> None:
+        """Draw new states for every random number generator, e.g. for runs forked from a shared state."""
+        rng = np.random.default_rng(seed)
+        np.random.seed(rng.integers(2**32))
+        random.seed(int(rng.integers(2**63)))
+        # an independent child stream, so the agents draw the same numbers as before
+        self.scenario.random = rng.spawn(1)[0]
+        self.random = rng
+        if self.engine is not None:
+            self.engine.random = rng
+        for p in self.population:
+            p.random = rng
+
+    def _checkpoint_due(self, n_iter: int) -> bool:
+        """Whether to checkpoint the run once `n_iter` iterations are saved."""
+        interval = self.sim.checkpoint_interval
+        return interval > 0 and n_iter % interval == 0 and n_iter < self.sim.max_iter
+
+    def load_checkpoint(self, path: Path) -> tuple[int, dict[str, np.typing.NDArray] | None]:
+        """Restore the dynamic state of the model from a checkpoint of a model of the same configuration.
+
+        Args:
+            path: Path of the checkpoint file.
+
+        Returns:
+            n_iter: Number of iterations saved before the checkpoint.
+            outputs: Saved frames stored with the checkpoint, if any.
+        """
+        with path.open('rb') as f:
+            state = _CheckpointUnpickler(f, self.scenario).load()
+
+        self.scenario.set_state(state['scenario'])
+        self.population = state['population']
+        self.engine = state['engine']
+        self.schedule_index = self.index_schedules()
+        np.random.set_state(state['random']['numpy'])
+        random.setstate(state['random']['python'])
+        self.random = state['random']['model']
+        return state['n_iter'], state['outputs']
+
+    def index_schedules(self) -> dict[int, list[BaseAgent]]:
+        """Index agents by the minutes of the day they have a scheduled action."""
+        index = defaultdict(list)
         for p in self.population:
-            ret.append((*p.state.pos, p.state.status.value))
-        return np.array(ret, dtype=np.int16)
+            for minute, action in p.schedule.items():
+                if action:
+                    index[minute].append(p)
+        return dict(index)
+
+    def allocate_frames(self, file: Path | None = None, resume: bool = False) -> np.typing.NDArray[np.int16]:
+        """Preallocate the buffer of every saved frame of agent positions and statuses.
+
+        Frame `i` is the view `frames[..., i, :, :]`. Ensembles keep the frames of each replicate
+        contiguous in a `(R, max_iter, size, 4)` buffer, other runs use a `(max_iter, N, 4)` buffer.
+
+        Args:
+            file: `.npy` file to memory-map the buffer to, so frames reach the disk as they are written.
+            resume: Reopen the frames already saved to `file`, if any, instead of starting afresh.
+        """
+        if self.engine is not None and self.engine.replicates > 1:
+            shape = (self.engine.replicates, self.sim.max_iter, self.engine.size, 4)
+        else:
+            n = self.engine.n if self.engine is not None else len(self.population)
+            shape = (self.sim.max_iter, n, 4)
+        if file is None:
+            return np.empty(shape, dtype=np.int16)
+        if resume and file.exists():
+            return np.lib.format.open_memmap(file, mode='r+')
+        return np.lib.format.open_memmap(file, mode='w+', dtype=np.int16, shape=shape)
+
+    def get_agents(self, out: np.typing.NDArray[np.int16] | None = None) -> np.typing.NDArray[np.int16]:
+        """Get position and status of all agents.
+
+        Args:
+            out: Array to write the frame into in place, typically a view of `allocate_frames()`.
+        """
+        if self.engine is not None:
+            return self.engine.get_agents(out)
+
+        if out is None:
+            out = np.empty((len(self.population), 4), dtype=np.int16)
+        out[:, :3] = [p.state.pos for p in self.population]
+        out[:, 3] = [p.state.status.value for p in self.population]
+        return out
 
     @abstractmethod
     def model_step(self) -> None:
@@ -1,7 +1,7 @@
 """SIR model simulation class."""
 
 import os
-from datetime import timedelta
+from dataclasses import replace
 from pathlib import Path
 from queue import Queue
 from typing import override
@@ -12,12 +12,15 @@ import tqdm
 from loguru import logger
 
 from simulation.agent import SIRAgent
+from simulation.agent.sir import EXCLUDE
 from simulation.model.base import BaseModel
+from simulation.population import SIRPopulation
 from simulation.scenario import SIRScenario
-from simulation.writer import AgentInfo
+from simulation.writer import AGENT_INFO_DTYPE, AgentInfo
 from utilities.types.agent import AgentStatus
 
 SUSCEPTIBLE, *_ = AgentStatus
+VARIANT_INFO = ('mask_type', 'vax_type', 'vax_doses')
 
 
 class SIRModel(BaseModel):
@@ -25,109 +28,248 @@ class SIRModel(BaseModel):
 
     population: list[SIRAgent]
     scenario: SIRScenario
+    engine: SIRPopulation | None
 
     @override
-    def __init__(self, config: Path) -> None:
-        super().__init__(config, agent_cls=SIRAgent, scenario_cls=SIRScenario)
+    def __init__(self, config: Path, ensemble: int | None = None) -> None:
+        super().__init__(
+            config, agent_cls=SIRAgent, scenario_cls=SIRScenario, population_cls=SIRPopulation, ensemble=ensemble
+        )
 
-    def summarize_agent_info(self) -> list[dict]:
-        """Summarize agent information for saving."""
-        ret = []
-        for p in self.population:
-            if p.info.vax_doses == 0:
-                vax = 'novax'
-            elif p.info.vax_doses == 1:
-                vax = '1dose'
-            elif p.info.vax_doses == 2:
-                vax = p.info.vax_type.lower()
-
-            if p.info.mask_type == 'NONE':
-                mask = 'nomask'
-            else:
-                mask = p.info.mask_type.lower()
-
-            ret.append(
-                {
-                    'age': p.age,
-                    'sex': np.random.choice(['M', 'F']),
-                    'long_covid': p.long_covid,
-                    'prevention_index': p.prevention_index,
-                    'mask': mask,
-                    'vax': vax,
-                    'infected': p.infected,
-                    'hospitalized': p.hospitalized,
-                    'deceased': p.deceased,
-                    'capacity': len(self.population),
-                }
-            )
+    def summarize_agent_info(self) -> np.typing.NDArray:
+        """Summarize agent information for saving as rows of the agent info table."""
+        if self.engine is not None:
+            return self.engine.summarize_agent_info()
+
+        n = len(self.population)
+        ret = np.empty(n, dtype=AGENT_INFO_DTYPE)
+        ret['sex'] = self.random.choice([b'M', b'F'], n)
+        ret['capacity'] = n
+        for key in ('age', 'long_covid', 'prevention_index', 'infected', 'hospitalized', 'deceased'):
+            ret[key] = [getattr(p, key) for p in self.population]
+        ret['mask'] = [p.info.mask_label for p in self.population]
+        ret['vax'] = [p.info.vax_label for p in self.population]
         return ret
 
+    def apply_variant(self, variant: dict) -> None:
+        """Modify the parameters of the scenario, e.g. to introduce an intervention in a run in progress.
+
+        Args:
+            variant: Field overrides of the scenario `prevention` index and `virus` information, and of
+                the mask and vaccination `info` of every agent, e.g. `{'info': {'mask_type': 'N95'}}`.
+        """
+        if 'prevention' in variant:
+            self.scenario.prevention = replace(self.scenario.prevention, **variant['prevention'])
+        if 'virus' in variant:
+            self.scenario.virus = replace(self.scenario.virus, **variant['virus'])
+
+        info = variant.get('info', {})
+        if invalid := set(info) - set(VARIANT_INFO):
+            raise ValueError(f'Variants can only override the {VARIANT_INFO} of agents, not {sorted(invalid)}.')
+
+        prevention = self.scenario.prevention
+        if self.engine is not None:
+            self.engine.info = [replace(i, **info) for i in self.engine.info]
+            self.engine.prevention_index[:] = [SIRAgent.protection(prevention, i) for i in self.engine.info]
+        for p in self.population:
+            p.info = replace(p.info, **info)
+            p.prevention_index = SIRAgent.protection(prevention, p.info)
+
     @override
     def model_step(self) -> None:
-        for _ in range(self.sim.save_resolution):
-            for p in self.population:
-                p.move()
+        remaining = self.sim.save_resolution
+        while remaining:
+            if self.engine is not None and (skip := min(self.engine.quiescent_ticks(), remaining)):
+                # nothing can change before the next event, jump the clock up to it or to the next frame
+                self.scenario.step_clock(skip)
+                remaining -= skip
+                continue
+
+            remaining -= 1
+            if self.engine is not None:
+                self.engine.step()
+            else:
+                for p, event in self.scenario.timeline.pop_due(self.scenario.tick):
+                    p.progress(event)
+                if self.scenario.check_schedule:
+                    for p in self.schedule_index.get(self.scenario.now, ()):
+                        if p.state.status not in EXCLUDE:
+                            p.check_schedule()
+                # paths requested together are computed in one batch, before they are followed
+                self.scenario.resolve_paths()
+                for p in self.population:
+                    p.move()
+                self.scenario.resolve_paths()
             self.scenario.ventilate()
 
-            self.scenario.dt += timedelta(seconds=self.sim.t_step)
-            # if self.scenario.dt.time().hour >= sanitation_time:
+            self.scenario.step_clock()
+            # if self.scenario.now >= sanitation_time:
             #     self.scenario.sanitize() # TODO: Add to config
 
-            now = self.scenario.dt.strftime('%H:%M')
-            self.scenario.check_schedule = self.scenario.now != now
-            if self.scenario.check_schedule:
-                self.scenario.now = now
-
     @override
-    def simulate(self, queue: Queue) -> None:
+    def simulate(self, queue: Queue, checkpoint: Path | None = None, start: int = 0) -> None:
+        """Run the simulation and publish the results to the writer.
+
+        Args:
+            queue: Public queue for sending data to zmq publisher.
+            checkpoint: Path of the periodic checkpoints of the run, `None` to disable them.
+            start: Number of iterations already saved when resuming from a checkpoint.
+        """
+        if self.sim.ensemble > 1:
+            raise ValueError('Ensembles can only be simulated with simulate_fast.')
+
         step = self.sim.save_resolution
-        pbar = tqdm.tqdm(desc='Timesteps', total=self.sim.max_iter * step, file=open(os.devnull, 'w'))
+        pbar = tqdm.tqdm(
+            desc='Timesteps', total=self.sim.max_iter * step, initial=start * step, file=open(os.devnull, 'w')
+        )
         logger.info(str(pbar), flush=True)
 
-        n_iter = 0
-        while n_iter < self.sim.max_iter:
-            if queue.empty():
-                pbar.update(step)
-                logger.info(f'{pbar}\033[F\033[K', flush=True)
-                n_iter += 1
-                self.model_step()
-                queue.put({'topic': 'timesteps', 'data': self.scenario.dt.timestamp()})
-                queue.put({'topic': 'agents', 'data': self.get_agents()})
-                if self.sim.save_verbose:
-                    queue.put({'topic': 'virus', 'data': self.scenario.virus.matrix.copy()})
+        # every frame is written once into its own slot, so views can be queued without copying
+        frames = self.allocate_frames()
+        n_iter = start
+        try:
+            while n_iter < self.sim.max_iter:
+                if queue.empty():
+                    pbar.update(step)
+                    logger.info(f'{pbar}\033[F\033[K', flush=True)
+                    self.model_step()
+                    queue.put({'topic': 'timesteps', 'data': self.scenario.dt.timestamp()})
+                    queue.put({'topic': 'agents', 'data': self.get_agents(out=frames[n_iter])})
+                    n_iter += 1
+                    if self.sim.save_verbose:
+                        queue.put({'topic': 'virus', 'data': self.scenario.virus_frame()})
+                    if checkpoint is not None and self._checkpoint_due(n_iter):
+                        # saved by the writer once the iterations before it are safely on disk
+                        queue.put(
+                            {'topic': 'checkpoint', 'data': {'path': checkpoint, 'state': self.dump_checkpoint(n_iter)}}
+                        )
+        finally:
+            self.scenario.close()
 
         logger.info(str(pbar), flush=True)
         queue.put({'topic': 'agent_info', 'data': self.summarize_agent_info()})
 
     @override
-    def simulate_fast(self, outfile: Path) -> None:
-        data = {'timesteps': [], 'agents': []}
+    def simulate_fast(
+        self,
+        outfile: Path | list[Path],
+        resume: bool = False,
+        warm_start: Path | None = None,
+        seed: int | list[int] | None = None,
+        variant: dict | None = None,
+    ) -> None:
+        """Run the simulation and write the results directly to file.
+
+        The run is checkpointed next to the first output file every `sim.checkpoint_interval` iterations,
+        and the checkpoint is removed once the results are written. Checkpoints only hold the state of
+        the model: frames are written to a memory-mapped file next to the checkpoint as they are saved.
+
+        Args:
+            outfile: Output file, or one output file per replicate for ensembles.
+            resume: Resume the run from its checkpoint, if any.
+            warm_start: Checkpoint of a shared burn-in or trunk to continue from, unless resuming.
+            seed: Seed of the new random states drawn when warm starting, e.g. shared by the branches of a trunk.
+            variant: Scenario modifications of the run, see `apply_variant`, applied after any checkpoint is loaded.
+        """
+        outfiles = [outfile] if isinstance(outfile, Path) else outfile
+        checkpoint = self.checkpoint_file(outfiles[0])
+        resume = resume and checkpoint.exists()
+        frames_file = self.frames_file(checkpoint) if self.sim.checkpoint_interval > 0 else None
+        frames = self.allocate_frames(frames_file, resume)
+        timesteps = np.empty(self.sim.max_iter, dtype=np.float64)
+
+        start = 0
+        if resume:
+            start, outputs = self.load_checkpoint(checkpoint)
+            logger.info(f'Resuming {outfiles[0]} from iteration {start}')
+        elif warm_start is not None:
+            start, outputs = self.load_checkpoint(warm_start)
+            self.reseed(seed)
+        if variant is not None:
+            self.apply_variant(variant)
+        if start:
+            if 'agents' in outputs:
+                frames[..., :start, :, :] = outputs['agents']
+            timesteps[:start] = outputs['timesteps']
 
         step = self.sim.save_resolution
-        pbar = tqdm.tqdm(desc=f'Run {int(outfile.stem):03}', total=self.sim.max_iter * step, file=open(os.devnull, 'w'))
+        pbar = tqdm.tqdm(
+            desc=f'Run {int(outfiles[0].stem):03}',
+            total=self.sim.max_iter * step,
+            initial=start * step,
+            file=open(os.devnull, 'w'),
+        )
+        try:
+            self._iterate(frames, timesteps, start, self.sim.max_iter, checkpoint, pbar)
+        finally:
+            self.scenario.close()
 
-        for i in range(self.sim.max_iter):
-            pbar.update(step)
-            self.model_step()
-            data['timesteps'].append(self.scenario.dt.timestamp())
-            data['agents'].append(self.get_agents())
-            if i % (self.sim.max_iter // 4) == 0:
-                logger.info(str(pbar), flush=True)
+        agent_info = self.summarize_agent_info()
+        if self.sim.ensemble > 1:
+            size = len(agent_info) // self.sim.ensemble
+            for r, outfile in enumerate(outfiles):
+                replicate = {'timesteps': timesteps, 'agents': frames[r]}
+                self._write_outputs(replicate, agent_info[r * size : (r + 1) * size], outfile)
+        else:
+            self._write_outputs({'timesteps': timesteps, 'agents': frames}, agent_info, outfiles[0])
+        checkpoint.unlink(missing_ok=True)
+        if frames_file is not None:
+            del frames
+            frames_file.unlink(missing_ok=True)
 
-        logger.debug(f'Writing simulation data to {outfile}')
-        self._write_outputs(data, outfile)
-        logger.debug(f'Simulation data written to {outfile}')
+    def burn_in(self, path: Path, n_iter: int | None = None) -> None:
+        """Simulate the first `n_iter` iterations and checkpoint them to `path` for runs to warm start from.
+
+        Args:
+            path: Path of the checkpoint file.
+            n_iter: Number of iterations to simulate, `sim.burn_in` by default.
+        """
+        frames = self.allocate_frames()
+        timesteps = np.empty(self.sim.max_iter, dtype=np.float64)
+        n_iter = min(self.sim.burn_in if n_iter is None else n_iter, self.sim.max_iter)
+        try:
+            self._iterate(frames, timesteps, 0, n_iter)
+        finally:
+            self.scenario.close()
+        self.save_checkpoint(path, n_iter, {'agents': frames[..., :n_iter, :, :], 'timesteps': timesteps[:n_iter]})
 
-    def _write_outputs(self, data: dict, outfile: Path) -> None:
+    def _iterate(
+        self,
+        frames: np.typing.NDArray[np.int16],
+        timesteps: np.typing.NDArray[np.float64],
+        start: int,
+        stop: int,
+        checkpoint: Path | None = None,
+        pbar: tqdm.tqdm | None = None,
+    ) -> None:
+        """Simulate iterations `start` to `stop`, saving their frames in place and checkpointing to `checkpoint`.
+
+        Checkpoints hold the frames of memory-mapped buffers by reference: the frames saved since the
+        previous checkpoint are flushed to disk before the state of the model is saved.
+        """
+        for i in range(start, stop):
+            self.model_step()
+            timesteps[i] = self.scenario.dt.timestamp()
+            self.get_agents(out=frames[..., i, :, :])
+            if pbar is not None:
+                pbar.update(self.sim.save_resolution)
+                if i % (self.sim.max_iter // 4) == 0:
+                    logger.info(str(pbar), flush=True)
+            if checkpoint is not None and self._checkpoint_due(i + 1):
+                outputs = {'timesteps': timesteps[: i + 1]}
+                if isinstance(frames, np.memmap):
+                    frames.flush()
+                else:
+                    outputs['agents'] = frames[..., : i + 1, :, :]
+                self.save_checkpoint(checkpoint, i + 1, outputs)
+
+    def _write_outputs(self, data: dict, agent_info: np.typing.NDArray, outfile: Path) -> None:
         """Write simulation data to HDF5 file directly."""
+        logger.debug(f'Writing simulation data to {outfile}')
         with tb.open_file(outfile, mode='w') as f:
             filters = tb.Filters(complevel=9, complib='blosc2')
             f.create_carray(f.root, 'agents', obj=data['agents'], filters=filters)
             f.create_carray(f.root, 'timesteps', obj=data['timesteps'], filters=filters)
-            f.create_table(f.root, 'agent_info', AgentInfo, filters=filters)
-
-            agent_info = f.root['agent_info'].row
-            for agent in self.summarize_agent_info():
-                for key, value in agent.items():
-                    agent_info[key] = value
-                agent_info.append()
+            table = f.create_table(f.root, 'agent_info', AgentInfo, filters=filters, expectedrows=len(agent_info))
+            table.append(agent_info)
+        logger.debug(f'Simulation data written to {outfile}')
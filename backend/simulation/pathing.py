@@ -3,17 +3,27 @@
 from __future__ import annotations
 
 import gzip
+import hashlib
+import os
 import pickle
-from collections import deque
+import shutil
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
 from pathlib import Path
 from typing import Self, overload
 
 import igraph as ig
 import numpy as np
+from loguru import logger
+from scipy.sparse import coo_array, csr_array
+from scipy.sparse.csgraph import dijkstra
 from scipy.spatial import KDTree
 
+from utilities.counters import CacheStats
 from utilities.paths import PATHS
-from utilities.types.pathing import ComputedPaths, Coordinate, Edge, PathSegment
+from utilities.types.pathing import CellPath, Coordinate, Edge
+from utilities.types.scenario import SimSetup
 
 DATA_PATH = Path(__file__).resolve().parent.parent / 'data'
 
@@ -30,6 +40,8 @@ class GraphGrid:
         edges: List of edges in the graph.
         edge_coords: List of coordinates for the edges.
         graph: igraph object representing the graph.
+        cache_size: Maximum number of shortest paths kept in the least recently used path cache.
+        cache_stats: Hit and miss counts of the path cache.
     """
 
     def __init__(
@@ -38,6 +50,7 @@ class GraphGrid:
         r: float = 1,
         spacing: dict = dict(),
         weights: np.typing.NDArray | None = None,
+        cache_size: int = 4096,
     ) -> None:
         """Initialize the graph with nodes and parameters.
 
@@ -46,14 +59,33 @@ class GraphGrid:
             r: Maximum radius for edge-query-pair computation.
             spacing: Spacing factors for each axis (adjacency distance).
             weights: Weights for the edges.
+            cache_size: Maximum number of cached shortest paths, `0` to disable the cache.
         """
         self.n = len(nodes)
         self.nodes = nodes
         self.vertex: dict[tuple, int] = {tuple(x): i for i, x in enumerate(nodes.tolist())}
         self.coord: dict[int, tuple] = {v: k for k, v in self.vertex.items()}
         self.weights = weights
+        self.cache_size = cache_size
+        self.cache_stats = CacheStats('GraphGrid.pathfind')
+        self._cache: OrderedDict[tuple[int, int], np.typing.NDArray[np.int32]] = OrderedDict()
         self._compute_edges(r, spacing)
 
+    @classmethod
+    def from_setup(cls, sim: SimSetup) -> Self:
+        """Build the graph of the walkable cells of a map, linking the floors through the stairs transit nodes.
+
+        Maps without stairs or transit nodes get no links between their floors.
+        """
+        valid_nodes = np.argwhere(sim.mask('VALID'))
+        graph = cls(valid_nodes, r=1, spacing={2: 2}, cache_size=sim.path_cache_size)
+        if sim.zone_id('STAIRS') >= 0 and sim.zone_id('TRANSIT_NODES') >= 0:
+            stair_nodes = np.argwhere(sim.mask('STAIRS') & sim.mask('TRANSIT_NODES'))
+            stairs = cls(stair_nodes, r=1, spacing={0: 2, 1: 2})
+            graph.add_edges(stairs, transform=True)
+        graph.build()
+        return graph
+
     def add_edges(self, edges: list[Edge], transform: bool = False) -> None:
         """Register additional edges to the graph.
 
@@ -68,28 +100,91 @@ class GraphGrid:
     def set_weights(self, weights: list[float]) -> None:
         """Set edge weights for subgraph creation and pruning."""
         self.weights = weights
+        self._cache.clear()
 
     def prune(self, threshold: float) -> None:
         """Prune graph edges based on a weight threshold."""
         self.edges = [x for i, x in enumerate(self.edges) if self.weights[i] < threshold]
         self.edge_coords = [x for i, x in enumerate(self.edge_coords) if self.weights[i] < threshold]
         self.weights = [x for x in self.weights if x < threshold]
+        self._cache.clear()
 
     def build(self) -> None:
         """Create the graph object from edges."""
         self.graph = ig.Graph(self.n, self.edges)
+        self._cache.clear()
 
-    def pathfind(self, start: Coordinate | int, end: Coordinate | int) -> PathSegment:
+    def adjacency(self) -> csr_array:
+        """Sparse `(n, n)` adjacency matrix of the graph, each edge stored once."""
+        edges = np.array(self.edges, dtype=np.int64).reshape(-1, 2)
+        return coo_array((np.ones(len(edges)), edges.T), shape=(self.n, self.n)).tocsr()
+
+    def pathfind(self, start: Coordinate | int, end: Coordinate | int) -> np.typing.NDArray:
         """Find the shortest path between two nodes in the graph.
 
         Args:
             start: Starting coordinate or vertex id.
             end: Ending coordinate or vertex id.
+
+        Returns:
+            path: `(L, 3)` array of node coordinates along the path.
         """
-        if isinstance(start, Coordinate) and isinstance(end, Coordinate):
+        if isinstance(start, tuple) and isinstance(end, tuple):
             start, end = self.vertex[start], self.vertex[end]
-        path = self.graph.get_shortest_paths(start, to=end, weights=self.weights)
-        return [self.coord[i] for i in path[0]]
+        return self.nodes[self.pathfind_vertices(start, end)]
+
+    def pathfind_vertices(self, start: int, end: int) -> np.typing.NDArray[np.int32]:
+        """Find the shortest path between two vertices, see `pathfind_many`.
+
+        Paths are cached once per pair of vertices, the path back being the reversed path, and the
+        cached read-only arrays are shared by every caller. Populations store the paths of cache
+        hits once for every agent following them, see `PathStore`.
+
+        Returns:
+            path: Vertex ids along the path.
+        """
+        return self.pathfind_many([start], [end])[0]
+
+    def pathfind_many(self, starts: list[int], ends: list[int]) -> list[np.typing.NDArray[np.int32]]:
+        """Find the shortest paths between pairs of vertices, through the least recently used path cache.
+
+        The paths missing from the cache are grouped by destination, and the paths of each group
+        are extracted from a single shortest path tree rooted at their destination.
+
+        Args:
+            starts: Starting vertex id of each path.
+            ends: Ending vertex id of each path.
+
+        Returns:
+            paths: Vertex ids along each path.
+        """
+        paths: list[np.typing.NDArray[np.int32] | None] = [None] * len(starts)
+        groups = defaultdict(list)
+        for k, (start, end) in enumerate(zip(starts, ends)):
+            key = (start, end) if start <= end else (end, start)
+            if (path := self._cache.get(key)) is None:
+                groups[end].append(k)
+                continue
+            self._cache.move_to_end(key)
+            self.cache_stats.hits += 1
+            paths[k] = path if start <= end else path[::-1]
+
+        for end, group in groups.items():
+            tree = self.graph.get_shortest_paths(end, to=[starts[k] for k in group], weights=self.weights)
+            self.cache_stats.misses += len(group)
+            for k, path in zip(group, tree):
+                paths[k] = np.array(path[::-1], dtype=np.int32)
+                self._remember(starts[k], end, paths[k])
+        return paths
+
+    def _remember(self, start: int, end: int, path: np.typing.NDArray[np.int32]) -> None:
+        """Add the path from `start` to `end` to the cache, evicting the least recently used path if full."""
+        if self.cache_size <= 0:
+            return
+        path.flags.writeable = False
+        self._cache[(start, end) if start <= end else (end, start)] = path if start <= end else path[::-1]
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
 
     def transform(self, other: GraphGrid) -> list[Edge]:
         """Transform edges from another graph to this graph's coordinates."""
@@ -102,7 +197,7 @@ class GraphGrid:
     def convert(self, edge: Edge) -> Edge:
         """Convert edge coordinates to graph vertex indices or vice versa."""
         start, end = edge
-        if isinstance(edge, Coordinate) and isinstance(end, Coordinate):
+        if isinstance(start, tuple) and isinstance(end, tuple):
             return (self.vertex[start], self.vertex[end])
         elif isinstance(start, int) and isinstance(end, int):
             return (self.coord[start], self.coord[end])
@@ -118,61 +213,697 @@ class GraphGrid:
         self.edge_coords = [(self.coord[a], self.coord[b]) for a, b in self.edges]
 
 
+_GRAPH: csr_array | None = None
+_CELLS: np.typing.NDArray[np.int32] | None = None
+
+_FIBONACCI = 0x9E3779B97F4A7C15
+_MASK64 = 2**64 - 1
+
+
+def _init_worker(graph: csr_array, cells: np.typing.NDArray[np.int32]) -> None:
+    """Share the graph between the tasks of a builder worker process."""
+    global _GRAPH, _CELLS
+    _GRAPH, _CELLS = graph, cells
+
+
+def _walk(predecessors: list[int], v: int) -> list[int]:
+    """Vertices along the shortest path tree `predecessors` from vertex `v` to the root of the tree."""
+    path = [v]
+    while (v := predecessors[v]) >= 0:
+        path.append(v)
+    return path
+
+
+def _transit_segments(
+    t: int, region: np.typing.NDArray, neighbours: np.typing.NDArray, limit: float
+) -> tuple[np.typing.NDArray, np.typing.NDArray, np.typing.NDArray[np.int32]]:
+    """Shortest paths from the cells of the region of transit node `t` and from its neighbouring transit nodes to `t`.
+
+    Args:
+        t: Vertex of the transit node.
+        region: Vertices of the cells nearest to `t`, other than `t`.
+        neighbours: Vertices of transit nodes whose regions border the region of `t`.
+        limit: Distance from `t` within which every path ends.
+
+    Returns:
+        starts: Vertex of the first node of each path, reached neighbours following the region.
+        lengths: Length of each path.
+        cells: Flat cell indices of the paths, back to back.
+    """
+    _, predecessors = dijkstra(
+        _GRAPH, directed=False, indices=t, unweighted=True, limit=limit, return_predecessors=True
+    )
+    predecessors = predecessors.tolist()
+    starts = [*region.tolist(), *(v for v in neighbours.tolist() if predecessors[v] >= 0)]
+    paths = [_walk(predecessors, v) for v in starts]
+    lengths = np.array([len(path) for path in paths], dtype=np.int64)
+    vertices = np.fromiter(chain.from_iterable(paths), dtype=np.int64, count=int(lengths.sum()))
+    return np.array(starts, dtype=np.int64), lengths, _CELLS[vertices]
+
+
+def _zone_distances(sources: np.typing.NDArray) -> np.typing.NDArray[np.float64]:
+    """Distance in steps of each vertex to the nearest of the vertices `sources`, `inf` if none reaches them."""
+    return dijkstra(_GRAPH, directed=False, indices=sources, unweighted=True, min_only=True)
+
+
+class SegmentTable:
+    """Path segments between pairs of nodes, in CSR layout with a hashed `(start, end)` index.
+
+    The segments are packed back to back in a flat int32 buffer of node ids, segment `i`
+    spanning `nodes[offsets[i]:offsets[i + 1]]`. The index is an open addressing hash table
+    of `start * n + end` keys with linear probing. Every array can be memory-mapped.
+
+    Attributes:
+        n: Number of node ids, bounding the `start` and `end` of the index keys.
+        nodes: Flat buffer of segment node ids.
+        offsets: `(S + 1,)` offset of each segment in `nodes`.
+        keys: `(K,)` key of each slot of the index, `-1` if empty, with `K` a power of two.
+        ids: `(K,)` segment id of each slot of the index.
+    """
+
+    def __init__(
+        self,
+        n: int,
+        nodes: np.typing.NDArray[np.int32],
+        offsets: np.typing.NDArray[np.int64],
+        keys: np.typing.NDArray[np.int64],
+        ids: np.typing.NDArray[np.int64],
+    ) -> None:
+        """Initialize the table from its arrays, see `from_segments`."""
+        self.n = n
+        self.nodes = nodes
+        self.offsets = offsets
+        self.keys = keys
+        self.ids = ids
+        self._bits = len(keys).bit_length() - 1
+
+    @classmethod
+    def from_segments(
+        cls,
+        n: int,
+        starts: np.typing.NDArray,
+        ends: np.typing.NDArray,
+        lengths: np.typing.NDArray,
+        nodes: np.typing.NDArray,
+    ) -> Self:
+        """Pack segments and index them on their first and last node ids.
+
+        Args:
+            n: Number of node ids.
+            starts: `(S,)` first node id of each segment.
+            ends: `(S,)` last node id of each segment.
+            lengths: `(S,)` length of each segment.
+            nodes: Node ids of the segments, back to back.
+        """
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        bits = max(int(2 * len(lengths)).bit_length(), 4)
+        keys = np.full(2**bits, -1, dtype=np.int64)
+        ids = np.zeros(2**bits, dtype=np.int64)
+        new = np.asarray(starts, dtype=np.int64) * n + np.asarray(ends, dtype=np.int64)
+        pending = np.arange(len(new))
+        slots = cls._hash(new, bits)
+        while pending.size:
+            # the first pending key probing a free slot claims it, the others probe the next slot
+            free = np.flatnonzero(keys[slots] < 0)
+            claimed, first = np.unique(slots[free], return_index=True)
+            keys[claimed] = new[pending[free[first]]]
+            ids[claimed] = pending[free[first]]
+            left = np.ones(len(pending), dtype=bool)
+            left[free[first]] = False
+            pending, slots = pending[left], (slots[left] + 1) & (2**bits - 1)
+
+        return cls(n, np.asarray(nodes, dtype=np.int32), offsets, keys, ids)
+
+    @staticmethod
+    def _hash(keys: np.typing.NDArray[np.int64], bits: int) -> np.typing.NDArray[np.int64]:
+        """Fibonacci hash of `keys` to `bits` bits."""
+        return ((keys.astype(np.uint64) * np.uint64(_FIBONACCI)) >> np.uint64(64 - bits)).astype(np.int64)
+
+    def get(self, start: int, end: int) -> np.typing.NDArray[np.int32] | None:
+        """View of the segment from node `start` to node `end`, `None` if there is none."""
+        key = int(start) * self.n + int(end)
+        slot = ((key * _FIBONACCI) & _MASK64) >> (64 - self._bits)
+        mask = len(self.keys) - 1
+        while (k := int(self.keys[slot])) >= 0:
+            if k == key:
+                i = int(self.ids[slot])
+                return self.nodes[self.offsets[i] : self.offsets[i + 1]]
+            slot = (slot + 1) & mask
+        return None
+
+    def save(self, directory: Path, name: str) -> None:
+        """Save the arrays of the table to `directory` as `<name>.<array>.npy` files."""
+        for array in ('nodes', 'offsets', 'keys', 'ids'):
+            np.save(directory / f'{name}.{array}.npy', getattr(self, array))
+
+    @classmethod
+    def load(cls, directory: Path, name: str, n: int) -> Self:
+        """Memory-map the arrays of the table saved as `name` in `directory`."""
+        arrays = {a: np.load(directory / f'{name}.{a}.npy', mmap_mode='r') for a in ('nodes', 'offsets', 'keys', 'ids')}
+        return cls(n, **arrays)
+
+
 class OptimizedPathfinder:
     """Optimized pathfinding solver for the simulation.
 
+    Every walkable cell is routed through its nearest transit node: `paths` holds the
+    segment from each cell to its nearest transit node and the segments between
+    neighbouring transit nodes, whose regions of nearest cells border each other.
+    `transit_paths` holds the sequence of transit nodes between any two transit nodes.
+    Segments between two nodes are only stored in one direction.
+
+    Nodes are flat cell indices of the map. Loaded pathfinders memory-map their arrays,
+    so they load instantly and share their pages between processes, and are pickled by
+    name.
+
     Attributes:
-        paths: Dictionary of paths between nodes.
-        transit_paths: Dictionary of transit paths between nodes.
+        shape: Shape of the map.
+        transit: `(X * Y * Z,)` nearest transit node of each cell, `-1` if none.
+        paths: Segments between cells and transit nodes.
+        transit_paths: Sequences of transit nodes between transit nodes.
+        name: Name the pathfinder was loaded from, if any.
     """
 
-    def __init__(self, paths: ComputedPaths, transit_paths: ComputedPaths) -> None:
+    def __init__(
+        self,
+        shape: tuple[int, int, int],
+        transit: np.typing.NDArray[np.int32],
+        paths: SegmentTable,
+        transit_paths: SegmentTable,
+        name: str | None = None,
+    ) -> None:
         """Initialize the pathfinder with computed paths and transit paths.
 
         Args:
-            paths: Dictionary of paths between nodes.
-            transit_paths: Dictionary of paths between transit nodes.
+            shape: Shape of the map.
+            transit: Nearest transit node of each cell, `-1` if none.
+            paths: Segments between cells and transit nodes.
+            transit_paths: Sequences of transit nodes between transit nodes.
+            name: Name the pathfinder was loaded from, if any.
         """
+        self.shape = tuple(shape)
+        self.transit = transit
         self.paths = paths
         self.transit_paths = transit_paths
+        self.name = name
+
+    def __reduce__(self) -> tuple:
+        """Pickle loaded pathfinders by name, to be memory-mapped again when unpickled."""
+        if self.name is None:
+            return super().__reduce__()
+        return type(self).load, (self.name,)
+
+    @staticmethod
+    def map_name(mapfile: str) -> str:
+        """Name of the pathfinder of a map: the stem of its map file or directory."""
+        return Path(mapfile).stem
+
+    @staticmethod
+    def file(name: str) -> Path:
+        """Path of the directory of the pathfinder `name`."""
+        return PATHS / name
 
     @classmethod
     def load(cls, name: str) -> Self:
-        """Load the pathfinder from a compressed file by name."""
-        with gzip.open(PATHS / f'{name}.gz', 'rb') as f:
-            return cls(**pickle.load(f))
+        """Memory-map the pathfinder saved by name."""
+        directory = cls.file(name)
+        shape = tuple(np.load(directory / 'shape.npy').tolist())
+        n = int(np.prod(shape))
+        return cls(
+            shape,
+            np.load(directory / 'transit.npy', mmap_mode='r'),
+            SegmentTable.load(directory, 'paths', n),
+            SegmentTable.load(directory, 'transit_paths', n),
+            name,
+        )
 
     def save(self, name: str) -> None:
-        """Save the pathfinder to a compressed file with the given name."""
-        with gzip.open(PATHS / f'{name}.gz', 'wb', compresslevel=1) as f:
-            pickle.dump({'paths': self.paths, 'transit_paths': self.transit_paths}, f)
+        """Save the pathfinder with the given name, replacing any previous version."""
+        directory = self.file(name)
+        tmp = directory.with_name(f'{directory.name}.tmp')
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        np.save(tmp / 'shape.npy', np.array(self.shape, dtype=np.int64))
+        np.save(tmp / 'transit.npy', self.transit)
+        self.paths.save(tmp, 'paths')
+        self.transit_paths.save(tmp, 'transit_paths')
+        # processes still mapping the previous version keep reading it until they reload
+        shutil.rmtree(directory, ignore_errors=True)
+        tmp.rename(directory)
+
+    @staticmethod
+    def legacy_file(name: str) -> Path | None:
+        """Gzipped pickle of the pathfinder `name` saved by earlier versions, if any.
+
+        Earlier versions loaded `bsf.gz` whatever the map, so it stands in for maps without their own file.
+        """
+        return next((f for f in (PATHS / f'{name}.gz', PATHS / 'bsf.gz') if f.exists()), None)
+
+    @classmethod
+    def from_legacy(cls, file: Path, shape: tuple[int, int, int]) -> Self:
+        """Convert a pathfinder saved by earlier versions as a gzipped pickle of coordinate segments.
+
+        Args:
+            file: Path of the gzipped pickle, see `legacy_file`.
+            shape: Shape of the map of the pathfinder.
+        """
+        with gzip.open(file, 'rb') as f:
+            legacy = pickle.load(f)
+
+        n = int(np.prod(shape))
+        transit = np.full(n, -1, dtype=np.int32)
+        tables = []
+        for key in ('paths', 'transit_paths'):
+            ends, segments = [], []
+            for start, routes in legacy[key].items():
+                for end, segment in routes.items():
+                    if end == 'transit':
+                        transit[np.ravel_multi_index(start, shape)] = np.ravel_multi_index(segment, shape)
+                    else:
+                        ends.append(end)
+                        segments.append(segment)
+            lengths = np.array([len(segment) for segment in segments], dtype=np.int64)
+            coords = np.array(list(chain.from_iterable(segments)), dtype=np.int64).reshape(-1, 3)
+            nodes = np.ravel_multi_index(coords.T, shape)
+            starts = nodes[np.cumsum(lengths) - lengths]
+            ends = np.ravel_multi_index(np.array(ends, dtype=np.int64).reshape(-1, 3).T, shape)
+            tables.append(SegmentTable.from_segments(n, starts, ends, lengths, nodes))
+        # transit nodes are their own nearest transit node
+        nodes = np.unique(tables[0].nodes[tables[0].offsets[1:] - 1])
+        transit[nodes] = nodes
+        return cls(shape, transit, *tables)
+
+    @classmethod
+    def build(cls, sim: SimSetup, workers: int | None = None) -> Self:
+        """Precompute the segments of every route of a map through its `TRANSIT_NODES`.
+
+        Each walkable cell is assigned to its nearest transit node by a multi-source search
+        over the graph of `GraphGrid.from_setup`. The segments of each region are then
+        computed in parallel by one bounded search from its transit node, and the transit
+        node sequences by a search over the graph of neighbouring transit nodes.
 
-    def get_segment(self, start: Coordinate, end: Coordinate, transit: bool = False) -> PathSegment:
+        Args:
+            sim: Simulation setup of the map, with its transit nodes.
+            workers: Number of worker processes, the number of CPUs by default.
+        """
+        if sim.zone_id('TRANSIT_NODES') < 0:
+            raise ValueError(f'Map {sim.mapfile} has no transit nodes, add `*.nodes.png` files to its directory.')
+
+        grid = GraphGrid.from_setup(sim)
+        graph = grid.adjacency()
+        cells = np.ravel_multi_index(grid.nodes.T, sim.shape).astype(np.int32)
+        transit = np.flatnonzero(sim.in_zone('TRANSIT_NODES', tuple(grid.nodes.T)))
+        logger.debug(f'Routing {grid.n} cells through {len(transit)} transit nodes...')
+
+        dist, _, sources = dijkstra(
+            graph, directed=False, indices=transit, unweighted=True, min_only=True, return_predecessors=True
+        )
+        if unreachable := int((sources < 0).sum()):
+            logger.warning(f'{unreachable} cells cannot reach any transit node and will not be routed.')
+        nearest = np.full(int(np.prod(sim.shape)), -1, dtype=np.int32)
+        nearest[cells[sources >= 0]] = cells[sources[sources >= 0]]
+
+        # regions of neighbouring transit nodes are joined by an edge, bounding the distance between them
+        edges = np.array(grid.edges, dtype=np.int64).reshape(-1, 2)
+        edges = edges[(sources[edges] >= 0).all(axis=1)]
+        edges = np.concatenate((edges, edges[:, ::-1]))
+        edges = edges[sources[edges[:, 0]] != sources[edges[:, 1]]]
+        bound = dist[edges].sum(axis=1) + 1
+
+        tasks = []
+        for t in transit.tolist():
+            region = np.flatnonzero(sources == t)
+            border = sources[edges[:, 0]] == t
+            neighbours = np.unique(sources[edges[border, 1]])
+            neighbours = neighbours[neighbours > t]  # segments between transit nodes are computed once
+            limit = max(dist[region].max(initial=0), bound[border].max(initial=0))
+            tasks.append((t, region[region != t], neighbours, limit))
+
+        segments = []
+        initargs = (graph, cells)
+        with ProcessPoolExecutor(workers or os.cpu_count(), initializer=_init_worker, initargs=initargs) as pool:
+            for (t, *_), (starts, lengths, nodes) in zip(tasks, pool.map(_transit_segments, *zip(*tasks), chunksize=4)):
+                segments.append((starts, np.full(len(starts), t), lengths, nodes))
+        starts, ends, lengths, nodes = (np.concatenate(a) for a in zip(*segments))
+        paths = SegmentTable.from_segments(len(nearest), cells[starts], cells[ends], lengths, nodes)
+
+        # transit node sequences over the graph of neighbouring transit nodes
+        index = np.full(grid.n, -1, dtype=np.int64)
+        index[transit] = np.arange(len(transit))
+        between = np.isin(starts, transit)
+        weights = (index[starts[between]], index[ends[between]])
+        transit_graph = coo_array((lengths[between] - 1, weights), shape=(len(transit),) * 2).tocsr()
+        _, predecessors = dijkstra(transit_graph, directed=False, return_predecessors=True)
+        sequences = []
+        for a, b in zip(*np.nonzero(np.triu(predecessors >= 0))):
+            sequence, v = [b], b
+            while (v := predecessors[a, v]) >= 0:
+                sequence.append(v)
+            sequences.append((a, b, len(sequence), cells[transit[sequence[::-1]]]))
+        a, b, lengths, nodes = zip(*sequences) if sequences else ([], [], [], [np.empty(0, dtype=np.int32)])
+        transit_paths = SegmentTable.from_segments(
+            len(nearest), cells[transit[list(a)]], cells[transit[list(b)]], lengths, np.concatenate(nodes)
+        )
+
+        return cls(sim.shape, nearest, paths, transit_paths)
+
+    def get_segment(self, start: int, end: int, transit: bool = False) -> CellPath:
         """Get the precomputed path segment between two nodes."""
         lookup = self.paths if not transit else self.transit_paths
-        try:
-            return lookup[start][end]
-        except KeyError:
-            return lookup[end][start][::-1]
-
-    def pathfind(self, start: Coordinate, end: Coordinate) -> PathSegment:
-        """Construct a path between two nodes using precomputed segments and transit node routing."""
+        if (segment := lookup.get(start, end)) is not None:
+            return segment
+        if (segment := lookup.get(end, start)) is not None:
+            return segment[::-1]
+        raise KeyError(f'No precomputed path segment between cells {start} and {end}.')
+
+    def pathfind_cells(self, start: int, end: int) -> CellPath:
+        """Construct the path between two flat cell indices using precomputed segments and transit node routing."""
         if start == end:
-            return deque([start])
+            return np.array([start], dtype=np.int32)
 
-        first_transit = self.paths[start]['transit']
-        last_transit = self.paths[end]['transit']
+        first_transit = int(self.transit[start])
+        last_transit = int(self.transit[end])
+        if first_transit < 0 or last_transit < 0:
+            raise KeyError(f'No transit node is reachable from cell {start if first_transit < 0 else end}.')
 
-        path = []
+        # consecutive segments share their joining node
+        path = [np.array([start], dtype=np.int32)]
         if start != first_transit:
-            path += self.get_segment(start, first_transit)
+            path.append(self.get_segment(start, first_transit)[1:])
         if first_transit != last_transit:
-            transit_path = self.get_segment(first_transit, last_transit, transit=True)
+            transit_path = self.get_segment(first_transit, last_transit, transit=True).tolist()
             for a, b in zip(transit_path, transit_path[1:]):
-                segment = self.get_segment(a, b)
-                path += segment[:-1]
-            path += segment[-1:]
+                path.append(self.get_segment(a, b)[1:])
         if last_transit != end:
-            path += self.get_segment(last_transit, end)
+            path.append(self.get_segment(last_transit, end)[1:])
 
-        return deque(path)
+        return np.concatenate(path)
+
+    def pathfind(self, start: Coordinate, end: Coordinate) -> np.typing.NDArray:
+        """Construct a path between two nodes using precomputed segments and transit node routing.
+
+        Returns:
+            path: `(L, 3)` array of node coordinates along the path.
+        """
+        cells = self.pathfind_cells(*np.ravel_multi_index(np.transpose([start, end]), self.shape).tolist())
+        return np.column_stack(np.unravel_index(cells, self.shape))
+
+
+class DistanceFields:
+    """Breadth-first distance fields of the zones of a map, descended one cell at a time.
+
+    The field of a zone holds the distance in steps of every cell to the nearest cell of the
+    zone, `0` in the zone and `UNREACHABLE` for cells that cannot reach it. Agents navigate
+    without paths by repeatedly moving to the neighbouring cell one step down the field of
+    their zone. Agents head to a cell of the zone, chosen when their task is set: once in
+    the zone, they walk straight to it as far as the cells of the zone allow.
+
+    Loaded fields memory-map their arrays and are pickled by name.
+
+    Attributes:
+        shape: Shape of the map.
+        zones: Zone of each field.
+        dist: `(F, X * Y * Z)` distance of each cell to the zone of each field.
+        up: `(X * Y * Z,)` whether each cell is linked to the cell above it by stairs.
+        key: Digest of the map the fields were computed for, see `map_key`.
+        name: Name the fields were loaded from, if any.
+    """
+
+    IGNORED = ('VALID', 'BARRIER', 'TRANSIT_NODES')
+    """Zones without a distance field."""
+
+    UNREACHABLE = np.iinfo(np.uint16).max
+    """Distance of the cells that cannot reach a zone."""
+
+    def __init__(
+        self,
+        shape: tuple[int, int, int],
+        zones: list[str],
+        dist: np.typing.NDArray[np.uint16],
+        up: np.typing.NDArray[np.bool_],
+        key: str,
+        name: str | None = None,
+    ) -> None:
+        """Initialize the fields from their distance arrays.
+
+        Args:
+            shape: Shape of the map.
+            zones: Zone of each field.
+            dist: `(F, X * Y * Z)` distance of each cell to the zone of each field.
+            up: `(X * Y * Z,)` whether each cell is linked to the cell above it by stairs.
+            key: Digest of the map the fields were computed for.
+            name: Name the fields were loaded from, if any.
+        """
+        self.shape = shape
+        self.zones = zones
+        self.dist = dist
+        self.up = up
+        self.key = key
+        self.name = name
+        self._fields = {zone: f for f, zone in enumerate(zones)}
+
+    def __reduce__(self) -> tuple:
+        """Pickle loaded fields by name, to be memory-mapped again when unpickled."""
+        if self.name is None:
+            return super().__reduce__()
+        return type(self).load, (self.name,)
+
+    @staticmethod
+    def file(name: str) -> Path:
+        """Path of the directory of the distance fields `name`."""
+        return PATHS / f'{name}.fields'
+
+    @classmethod
+    def load(cls, name: str) -> Self:
+        """Memory-map the distance fields saved by name."""
+        directory = cls.file(name)
+        return cls(
+            tuple(np.load(directory / 'shape.npy').tolist()),
+            np.load(directory / 'zones.npy').tolist(),
+            np.load(directory / 'dist.npy', mmap_mode='r'),
+            np.load(directory / 'up.npy', mmap_mode='r'),
+            str(np.load(directory / 'key.npy')),
+            name,
+        )
+
+    def save(self, name: str) -> None:
+        """Save the distance fields with the given name, replacing any previous version."""
+        directory = self.file(name)
+        tmp = directory.with_name(f'{directory.name}.tmp')
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        np.save(tmp / 'shape.npy', np.array(self.shape, dtype=np.int64))
+        np.save(tmp / 'zones.npy', np.array(self.zones))
+        np.save(tmp / 'dist.npy', self.dist)
+        np.save(tmp / 'up.npy', self.up)
+        np.save(tmp / 'key.npy', np.array(self.key))
+        shutil.rmtree(directory, ignore_errors=True)
+        tmp.rename(directory)
+
+    @staticmethod
+    def map_key(sim: SimSetup) -> str:
+        """Digest of the cells and zones of a map, which change its distance fields."""
+        digest = hashlib.sha256()
+        for array in (np.array(sim.labels.shape), sim.labels, sim.label_zones, np.array(list(sim.zone_ids))):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    @classmethod
+    def for_setup(cls, sim: SimSetup, workers: int | None = None) -> Self:
+        """Load the distance fields of a map, building and caching them first if missing or outdated."""
+        name = OptimizedPathfinder.map_name(sim.mapfile)
+        key = cls.map_key(sim)
+        if not (cls.file(name) / 'key.npy').exists() or str(np.load(cls.file(name) / 'key.npy')) != key:
+            cls.build(sim, workers).save(name)
+        return cls.load(name)
+
+    @classmethod
+    def zones_of(cls, sim: SimSetup) -> list[str]:
+        """Zones of a map with a distance field: the terrain zones with walkable cells."""
+        valid = sim.zone_ids['VALID']
+        zones = [zone for zone in sim.zone_ids if zone not in cls.IGNORED]
+        return [zone for zone in zones if (sim.label_zones[:, sim.zone_ids[zone]] & sim.label_zones[:, valid]).any()]
+
+    @classmethod
+    def build(cls, sim: SimSetup, workers: int | None = None) -> Self:
+        """Compute the distance fields of the walkable zones of a map, over the graph of `GraphGrid.from_setup`.
+
+        Args:
+            sim: Simulation setup of the map.
+            workers: Number of worker processes, the number of CPUs by default.
+        """
+        grid = GraphGrid.from_setup(sim)
+        cells = np.ravel_multi_index(grid.nodes.T, sim.shape).astype(np.int32)
+        zones = cls.zones_of(sim)
+        logger.debug(f'Computing the distance fields of {len(zones)} zones over {grid.n} cells...')
+
+        sources = [np.flatnonzero(sim.in_zone(zone, tuple(grid.nodes.T))) for zone in zones]
+        dist = np.full((len(zones), int(np.prod(sim.shape))), cls.UNREACHABLE, dtype=np.uint16)
+        initargs = (grid.adjacency(), cells)
+        with ProcessPoolExecutor(workers or os.cpu_count(), initializer=_init_worker, initargs=initargs) as pool:
+            for f, distances in enumerate(pool.map(_zone_distances, sources)):
+                reached = np.isfinite(distances)
+                if distances[reached].max(initial=0) >= cls.UNREACHABLE:
+                    raise ValueError(f'Zone {zones[f]} of map {sim.mapfile} is too far for uint16 distance fields.')
+                dist[f, cells[reached]] = distances[reached]
+
+        # stairs are the only edges between floors
+        edges = np.array(grid.edges, dtype=np.int64).reshape(-1, 2)
+        vertical = (grid.nodes[edges[:, 0], :2] == grid.nodes[edges[:, 1], :2]).all(axis=1)
+        up = np.zeros(int(np.prod(sim.shape)), dtype=bool)
+        up[cells[edges[vertical]].min(axis=1)] = True
+
+        return cls(sim.shape, zones, dist, up, cls.map_key(sim))
+
+    def index(self, zones: list[str]) -> np.typing.NDArray[np.int64]:
+        """Field of each of `zones`, `-1` if it has none."""
+        return np.array([self._fields.get(zone, -1) for zone in zones], dtype=np.int64)
+
+    def reachable(self, field: np.typing.NDArray[np.int64], cells: np.typing.NDArray) -> np.typing.NDArray[np.bool_]:
+        """Whether each of `cells` can reach the zone of its field."""
+        return self.dist[field, cells] != self.UNREACHABLE
+
+    def descend(
+        self, field: np.typing.NDArray[np.int64], cells: np.typing.NDArray, targets: np.typing.NDArray
+    ) -> tuple[np.typing.NDArray, np.typing.NDArray[np.bool_]]:
+        """Move `cells` one step towards `targets`, down the fields `field` of their zones, then within them.
+
+        Within their zone, cells move along the axis of their largest distance to their target,
+        or along the other one if that leaves the zone.
+
+        Returns:
+            cells: Next cell of each cell.
+            arrived: Whether each next cell is the target, or the closest to it the zone allows.
+        """
+        nx, ny, nz = self.shape
+        x, y, z = np.unravel_index(cells, self.shape)
+        step = cells.copy()
+        outside = self.dist[field, cells] > 0
+        if outside.any():
+            # neighbours along -x, +x, -y, +y, then down and up the stairs
+            offsets = np.array([-ny * nz, ny * nz, -nz, nz, -1, 1])
+            below = np.where(z > 0, cells - 1, cells)
+            linked = (x > 0, x < nx - 1, y > 0, y < ny - 1, (z > 0) & self.up[below], self.up[cells])
+            linked = np.column_stack(linked)[outside]
+            neighbours = np.where(linked, cells[outside, None] + offsets, cells[outside, None])
+            dist = np.where(linked, self.dist[field[outside, None], neighbours], self.UNREACHABLE)
+            step[outside] = neighbours[np.arange(len(neighbours)), dist.argmin(axis=1)]
+
+        arrived = np.zeros(len(cells), dtype=bool)
+        if (inside := ~outside).any():
+            field, cells, targets = field[inside], cells[inside], targets[inside]
+            x, y = x[inside], y[inside]
+            tx, ty, _ = np.unravel_index(targets, self.shape)
+            dx, dy = np.sign(tx - x) * ny * nz, np.sign(ty - y) * nz
+            along_x = np.abs(tx - x) >= np.abs(ty - y)
+            moved = cells.copy()
+            for offset in (np.where(along_x, dx, dy), np.where(along_x, dy, dx)):
+                stuck = moved == cells
+                candidate = cells + offset * stuck
+                moved = np.where(stuck & (self.dist[field, candidate] == 0), candidate, moved)
+            step[inside] = moved
+            arrived[inside] = (moved == targets) | (moved == cells)
+        return step, arrived
+
+
+class PathStore:
+    """Shared reference-counted storage for flat cell index paths.
+
+    Paths are packed back to back in a single int32 buffer and addressed by a
+    path id, so a population can gather the next cell of every agent at once.
+    Pathfinders give a single path between two cells, so a path between the same
+    first and last cells as a stored path shares its id, with one more reference,
+    e.g. the paths of agents served by the same entry of the `GraphGrid` path cache.
+    Paths without references are reclaimed when the buffer is compacted.
+
+    Attributes:
+        cells: Flat buffer of path cell indices.
+        start: Offset of each path id in `cells`.
+        length: Length of each path id.
+        refs: Number of holders of each path id, `-1` if unused.
+        stats: Number of added paths sharing a stored path (hits) or stored anew (misses).
+    """
+
+    def __init__(self, capacity: int = 1024) -> None:
+        """Initialize an empty path store.
+
+        Args:
+            capacity: Initial number of cells in the buffer.
+        """
+        self.cells = np.empty(capacity, dtype=np.int32)
+        self.start = np.zeros(0, dtype=np.int64)
+        self.length = np.zeros(0, dtype=np.int64)
+        self.refs = np.zeros(0, dtype=np.int64)
+        self._ids: dict[tuple[int, int], int] = {}
+        self.stats = CacheStats('PathStore.add')
+        self._free: list[int] = []
+        self._size = 0
+        self._grow_ids()
+
+    def add(self, path: CellPath) -> int:
+        """Store non-empty `path`, unless already stored, and return its path id with one more reference."""
+        key = (int(path[0]), int(path[-1]))
+        if (path_id := self._ids.get(key)) is not None:
+            self.refs[path_id] += 1
+            self.stats.hits += 1
+            return path_id
+        self.stats.misses += 1
+
+        if self._size + len(path) > len(self.cells):
+            self._compact(len(path))
+
+        if not self._free:
+            self._grow_ids()
+        path_id = self._free.pop()
+
+        self.cells[self._size : self._size + len(path)] = path
+        self.start[path_id] = self._size
+        self.length[path_id] = len(path)
+        self.refs[path_id] = 1
+        self._ids[key] = path_id
+        self._size += len(path)
+        return path_id
+
+    def get(self, path_id: int) -> CellPath:
+        """Return a view of the cells of path `path_id`."""
+        start = self.start[path_id]
+        return self.cells[start : start + self.length[path_id]]
+
+    def release(self, path_ids: np.typing.NDArray[np.intp]) -> None:
+        """Drop one reference to each of `path_ids`, ignoring negative ids."""
+        path_ids = path_ids[path_ids >= 0]
+        np.subtract.at(self.refs, path_ids, 1)
+        freed = np.unique(path_ids[self.refs[path_ids] == 0])
+        first, last = self.start[freed], self.start[freed] + self.length[freed] - 1
+        for key in zip(self.cells[first].tolist(), self.cells[last].tolist()):
+            del self._ids[key]
+        self.length[freed] = 0
+        self.refs[freed] = -1
+        self._free.extend(freed.tolist())
+
+    def _grow_ids(self) -> None:
+        """Double the number of available path ids."""
+        n = len(self.start)
+        grow = max(n, 64)
+        self.start = np.concatenate((self.start, np.zeros(grow, dtype=np.int64)))
+        self.length = np.concatenate((self.length, np.zeros(grow, dtype=np.int64)))
+        self.refs = np.concatenate((self.refs, np.full(grow, -1, dtype=np.int64)))
+        self._free.extend(range(n + grow - 1, n - 1, -1))
+
+    def _compact(self, size: int) -> None:
+        """Pack the live paths to the front of the buffer, growing it to fit `size` new cells."""
+        total = int(self.length.sum())
+        capacity = len(self.cells)
+        while capacity < 2 * (total + size):
+            capacity *= 2
+
+        offsets = np.cumsum(self.length) - self.length
+        src = np.repeat(self.start - offsets, self.length) + np.arange(total)
+        cells = np.empty(capacity, dtype=np.int32)
+        cells[:total] = self.cells[src]
+
+        self.cells = cells
+        self.start = offsets
+        self._size = total
@@ -0,0 +1,6 @@
+"""Import entrypoint for the population module."""
+
+from simulation.population.base import BasePopulation
+from simulation.population.sir import SIRPopulation
+
+__all__ = ['BasePopulation', 'SIRPopulation']
@@ -0,0 +1,311 @@
+"""Base struct-of-arrays population class for simulation."""
+
+from abc import ABC, abstractmethod
+from collections import defaultdict
+
+import numpy as np
+
+from simulation.agent import BaseAgent
+from simulation.pathing import PathStore
+from simulation.scenario import MINUTES_PER_DAY, BaseScenario
+from utilities.types.agent import AgentInfo, AgentStatus
+from utilities.types.pathing import CellPath
+
+
+class BasePopulation(ABC):
+    """Struct-of-arrays population backend for simulation.
+
+    Agent state is stored in contiguous arrays indexed by agent id so the whole
+    population can be advanced with vectorized operations. Each agent follows
+    a path held in a shared `PathStore` through a `(path_id, cursor, wait)`
+    triple, or descends the distance `field` of its destination zone when the
+    scenario navigates with fields, then waits in place for `wait` time steps.
+
+    Only active agents are visited every time step: those following a path,
+    and those whose wait ends on the current time step. Waiting agents are
+    kept in buckets keyed on their wake-up tick, and agents idle in `EXIT` are
+    parked until a new task is given to them.
+
+    An ensemble of `sim.ensemble` replicates is stored as one population of
+    consecutive, equally sized blocks of agents. Each agent's flat cell index
+    points into the virus field of its replicate, while paths and terrain masks
+    are shared between replicates.
+
+    Attributes:
+        scenario: Scenario instance from simulation.scenario module.
+        n: Number of agents in the population, over all replicates.
+        replicates: Number of replicates in the population.
+        size: Number of agents in each replicate.
+        info: General information of each agent.
+        random: Numpy random number generator instance.
+        offset: `(N,)` flat cell index of the origin of each agent's replicate in the virus field.
+        cell: `(N,)` flat cell index of the current position of each agent in the virus field.
+        status: `(N,)` infection status value of each agent.
+        paths: Shared storage of the paths followed by the agents.
+        path_id: `(N,)` id of each agent's current path in `paths`, `-1` if none.
+        cursor: `(N,)` index of the next cell along each agent's path.
+        wait: `(N,)` time steps to wait once each agent's path is completed.
+        field: `(N,)` index of the zone distance field each agent descends, `-1` if none.
+        target: `(N,)` flat cell each agent descending a field heads to.
+        moving: Ids of the agents following a path or descending a field.
+        wake: `(N,)` tick on which each waiting agent needs a new task, `-1` if not waiting.
+        wakeups: Ids of the waiting agents keyed on their wake-up tick, possibly stale.
+        exited: `(N,)` whether each agent is parked in `EXIT`.
+        home_zone: `(N,)` zone id of each agent's home zone, `-1` if none.
+        work_zone: `(N,)` zone id of each agent's work zone, `-1` if none.
+        schedules: Schedule of each agent keyed on minute of the day.
+        schedule_index: Ids of the agents with a scheduled action keyed on minute of the day.
+        last_action_time: `(N,)` minute of the last scheduled action of each agent, `-1` if none.
+    """
+
+    def __init__(self, scenario: BaseScenario, agents: list[BaseAgent]) -> None:
+        """Initialize the population arrays from instantiated agents.
+
+        Args:
+            scenario: Scenario instance from simulation.scenario module.
+            agents: Agents to convert into the struct-of-arrays layout, grouped by replicate.
+        """
+        self.scenario = scenario
+        self.n = len(agents)
+        self.replicates = scenario.sim.ensemble
+        self.size = self.n // self.replicates
+        self.info: list[AgentInfo] = [p.info for p in agents]
+        self.random = np.random.default_rng()
+
+        n_cells = int(np.prod(scenario.sim.shape))
+        dtype = np.int32 if self.replicates * n_cells <= np.iinfo(np.int32).max else np.int64
+        self.offset = (np.arange(self.n) // max(self.size, 1) * n_cells).astype(dtype)
+        pos = np.array([p.state.pos for p in agents], dtype=np.intp).reshape(self.n, 3)
+        self.cell = np.ravel_multi_index(pos.T, scenario.sim.shape).astype(dtype) + self.offset
+        self.status = np.array([p.state.status.value for p in agents], dtype=np.int8)
+
+        self.home_zone = np.array([p.zone_ids['HOME'] for p in agents], dtype=np.int16)
+        self.work_zone = np.array([p.zone_ids['WORK'] for p in agents], dtype=np.int16)
+        self.schedules: list[dict[int, str]] = [p.schedule for p in agents]
+        index = defaultdict(list)
+        for i, schedule in enumerate(self.schedules):
+            for minute, action in schedule.items():
+                if action:
+                    index[minute].append(i)
+        self.schedule_index = {k: np.array(v, dtype=np.intp) for k, v in index.items()}
+        self.last_action_time = np.array(
+            [-1 if p.dt.last_action_time is None else p.dt.last_action_time for p in agents], dtype=np.int64
+        )
+
+        self.paths = PathStore(max(1024, 64 * self.n))
+        self.path_id = np.full(self.n, -1, dtype=np.int64)
+        self.cursor = np.array([p.state.cursor for p in agents], dtype=np.int64)
+        self.wait = np.array([p.state.wait for p in agents], dtype=np.int64)
+        self.field = np.full(self.n, -1, dtype=np.int64)
+        self.target = np.full(self.n, -1, dtype=np.int64)
+        for i, p in enumerate(agents):
+            if p.state.path is not None and len(p.state.path):
+                self.path_id[i] = self.paths.add(p.state.path)
+
+        self.moving = np.flatnonzero(self.path_id >= 0)
+        self._started: list[int] = []
+        self.wake = np.full(self.n, -1, dtype=np.int64)
+        self.wakeups: dict[int, list[np.typing.NDArray[np.intp]]] = defaultdict(list)
+        self.exited = np.zeros(self.n, dtype=bool)
+        # agents without a path count their wait down from the current time step
+        self._sleep(np.flatnonzero(self.path_id < 0), self.wait[self.path_id < 0], self.scenario.tick)
+
+    @property
+    def pos(self) -> np.typing.NDArray:
+        """`(N, 3)` current spatial position of each agent."""
+        return np.column_stack(np.unravel_index(self.cell - self.offset, self.scenario.sim.shape))
+
+    def get_agents(self, out: np.typing.NDArray[np.int16] | None = None) -> np.typing.NDArray[np.int16]:
+        """Get position and status of all agents, with a leading replicate axis for ensembles.
+
+        Args:
+            out: `(N, 4)`, or `(R, size, 4)` for ensembles, array to write the frame into, possibly a view.
+        """
+        if out is None:
+            out = np.empty((self.n, 4) if self.replicates == 1 else (self.replicates, self.size, 4), dtype=np.int16)
+        cells = (self.cell - self.offset).reshape(out.shape[:-1])
+        for k, coord in enumerate(np.unravel_index(cells, self.scenario.sim.shape)):
+            out[..., k] = coord
+        out[..., 3] = self.status.reshape(out.shape[:-1])
+        return out
+
+    def is_(self, status: AgentStatus) -> np.typing.NDArray[np.bool_]:
+        """Check which agents have status `status`."""
+        return self.status == status.value
+
+    def in_(self, zone: str, idx: np.typing.NDArray[np.intp]) -> np.typing.NDArray[np.bool_]:
+        """Check which agents in `idx` are in `zone`."""
+        sim = self.scenario.sim
+        labels = sim.labels.reshape(-1)
+        cells = self.cell[idx] % labels.size if self.replicates > 1 else self.cell[idx]
+        match zone:
+            case 'WORK':
+                ids = self.work_zone[idx]
+            case 'HOME':
+                ids = self.home_zone[idx]
+            case _:
+                ids = np.full(len(idx), sim.zone_id(zone))
+        return sim.label_zones[labels[cells], ids] & (ids >= 0)
+
+    def set_path(self, i: int, path: CellPath) -> None:
+        """Replace the path of agent `i` with flat cell indices `path`, or make it wait if `path` is empty."""
+        if len(path) == 0:
+            # unreachable destination, wait in place rather than follow a path to nowhere
+            self.set_wait(np.array([i]), self.wait[i])
+            return
+        self.paths.release(self.path_id[i : i + 1])
+        self.path_id[i] = self.paths.add(path)
+        self.field[i] = -1
+        self.cursor[i] = 0
+        self.wake[i] = -1
+        if self.exited[i]:
+            self._set_exited(np.array([i]), False)
+        self._started.append(i)
+
+    def set_wait(self, idx: np.typing.NDArray[np.intp], wait: int) -> None:
+        """Make agents `idx` wait at their current position for `wait` time steps."""
+        if len(idx) == 0:
+            return
+        self.paths.release(self.path_id[idx])
+        self.path_id[idx] = -1
+        self.field[idx] = -1
+        self.wait[idx] = wait
+        self._sleep(idx, self.wait[idx], self.scenario.tick + 1)
+
+    def set_field(
+        self, idx: np.typing.NDArray[np.intp], field: np.typing.NDArray[np.int64], target: np.typing.NDArray
+    ) -> None:
+        """Make agents `idx` descend the distance fields `field` to cells `target`, or wait if they cannot."""
+        fields = self.scenario.fields
+        self.paths.release(self.path_id[idx])
+        self.path_id[idx] = -1
+        reachable = field >= 0
+        reachable[reachable] = fields.reachable(
+            field[reachable], self.cell[idx[reachable]] - self.offset[idx[reachable]]
+        )
+        self.field[idx] = np.where(reachable, field, -1)
+        self.target[idx] = target
+        self.wake[idx[reachable]] = -1
+        self._set_exited(idx[reachable], False)
+        self._started.extend(idx[reachable].tolist())
+        self._sleep(idx[~reachable], self.wait[idx[~reachable]], self.scenario.tick + 1)
+
+    def park(self, idx: np.typing.NDArray[np.intp]) -> None:
+        """Deactivate idle agents `idx` in `EXIT` until they are given a new task."""
+        self._set_exited(idx, True)
+
+    def _set_exited(self, idx: np.typing.NDArray[np.intp], exited: bool) -> None:
+        """Flag agents `idx` as parked in `EXIT` or not, the only way `exited` changes."""
+        self.exited[idx] = exited
+
+    def _sleep(self, idx: np.typing.NDArray[np.intp], wait: np.typing.NDArray, start: int) -> None:
+        """Wake agents `idx` up `wait` time steps after tick `start`."""
+        if len(idx) == 0:
+            return
+        self.wake[idx] = start + wait
+        order = np.argsort(self.wake[idx], kind='stable')
+        idx, wake = idx[order], self.wake[idx[order]]
+        ticks, first = np.unique(wake, return_index=True)
+        for tick, group in zip(ticks.tolist(), np.split(idx, first[1:])):
+            self.wakeups[tick].append(group)
+
+    def set_task(self, i: int, zone: str) -> None:
+        """Defines a new task / path for agent `i`.
+
+        Args:
+            i: Index of the agent.
+            zone: The zone to pathfind to.
+        """
+        self.set_tasks(np.array([i]), [zone])
+
+    def set_tasks(self, idx: np.typing.NDArray[np.intp], zones: str | list[str]) -> None:
+        """Defines new tasks / paths for agents `idx`, pathfinding for all of them in one batch.
+
+        Args:
+            idx: Indices of the agents.
+            zones: The zone to pathfind to, or the zone of each agent.
+        """
+        if not len(idx):
+            return
+        zones = [zones] * len(idx) if isinstance(zones, str) else list(zones)
+        for k, (i, zone) in enumerate(zip(idx.tolist(), zones)):
+            match zone:
+                case 'WORK':
+                    zones[k] = self.info[i].work_zone
+                case 'HOME':
+                    zones[k] = self.info[i].home_zone
+
+        t_step = self.scenario.sim.t_step
+        wait_time = np.where(np.array(zones) == 'OPEN', 300 // t_step, 3600 // t_step)  # seconds
+        self.wait[idx] = (wait_time * (1 + self.random.random(len(idx))) * 0.5).astype(np.int64)
+
+        ends = [self.scenario.get_idx(zone) for zone in zones]
+        if self.scenario.fields is not None:
+            targets = np.ravel_multi_index(np.transpose(ends), self.scenario.sim.shape)
+            self.set_field(idx, self.scenario.fields.index(zones), targets)
+            return
+
+        starts = [self.scenario.to_coord(cell) for cell in (self.cell[idx] - self.offset[idx]).tolist()]
+        for i, path in zip(idx.tolist(), self.scenario.pathfind_many(starts, ends)):
+            self.set_path(i, path)
+
+    def next_event_tick(self) -> int:
+        """Earliest tick on which a waiting agent wakes up, a scheduled action is due or an event fires."""
+        scenario = self.scenario
+        ticks = [min(self.wakeups, default=np.iinfo(np.int64).max)]
+        if (tick := scenario.timeline.next_tick()) is not None:
+            ticks.append(tick)
+        if scenario.check_schedule and scenario.now in self.schedule_index:
+            ticks.append(scenario.tick)
+        elif self.schedule_index:
+            # minutes until the next scheduled minute of the day, wrapping around midnight
+            wait = min((m - scenario.now - 1) % MINUTES_PER_DAY + 1 for m in self.schedule_index)
+            ticks.append(scenario.tick_of_minute(scenario.minute + wait))
+        return min(ticks)
+
+    def advance(self) -> np.typing.NDArray[np.intp]:
+        """Move every agent with a pending path or field one step along it, and wake up agents done waiting.
+
+        Returns:
+            idle: Ids of the agents with neither a path, a field nor a wait pending.
+        """
+        tick = self.scenario.tick
+        moving = self.moving
+        if self._started:
+            moving = np.union1d(moving, self._started)
+            self._started = []
+        moving = moving[(self.path_id[moving] >= 0) | (self.field[moving] >= 0)]
+
+        walking = moving[self.path_id[moving] >= 0]
+        path_id = self.path_id[walking]
+        self.cell[walking] = self.paths.cells[self.paths.start[path_id] + self.cursor[walking]] + self.offset[walking]
+        self.cursor[walking] += 1
+
+        finished = self.cursor[walking] >= self.paths.length[path_id]
+        done = walking[finished]
+        self.paths.release(self.path_id[done])
+        self.path_id[done] = -1
+
+        if self.scenario.fields is not None:
+            descending = moving[self.field[moving] >= 0]
+            cells, arrived = self.scenario.fields.descend(
+                self.field[descending], self.cell[descending] - self.offset[descending], self.target[descending]
+            )
+            self.cell[descending] = cells + self.offset[descending]
+            self.field[descending[arrived]] = -1
+            done = np.concatenate((done, descending[arrived]))
+
+        self.moving = moving[(self.path_id[moving] >= 0) | (self.field[moving] >= 0)]
+        self._sleep(done, self.wait[done], tick + 1)
+
+        if not (due := self.wakeups.pop(tick, None)):
+            return np.empty(0, dtype=np.intp)
+        idle = np.unique(np.concatenate(due))
+        idle = idle[(self.wake[idle] == tick) & (self.path_id[idle] < 0) & (self.field[idle] < 0)]
+        self.wake[idle] = -1
+        return idle
+
+    @abstractmethod
+    def step(self) -> None:
+        """Population timestep logic."""
+        pass
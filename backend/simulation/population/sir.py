@@ -0,0 +1,215 @@
+"""SIR struct-of-arrays population class for simulation."""
+
+from typing import override
+
+import numpy as np
+
+from simulation.agent import SIRAgent
+from simulation.population.base import BasePopulation
+from simulation.scenario import VIRUS_SCALE, SIRScenario
+from simulation.writer import AGENT_INFO_DTYPE
+from utilities.types.agent import AgentEvent, AgentStatus
+
+QUARANTINE, RECOVERY = AgentEvent
+SUSCEPTIBLE, INFECTED, RECOVERED, QUARANTINED, DECEASED, HOSPITALIZED, UNKNOWN = (s.value for s in AgentStatus)
+
+EXCLUDE = (QUARANTINED, HOSPITALIZED, DECEASED)
+CONTAGIOUS = (INFECTED, QUARANTINED, HOSPITALIZED)
+
+
+class SIRPopulation(BasePopulation):
+    """Subclassed struct-of-arrays population for SIR simulation.
+
+    Attributes:
+        prevention_index: `(N,)` protection from infection - vaccines and masks.
+        age: `(N,)` age of each agent.
+        susceptibility: `(N,)` susceptibility to infection.
+        severity: `(N,)` severity of the disease.
+        long_covid: `(N,)` whether each agent has long COVID.
+        infected: `(N,)` whether each agent has been infected.
+        hospitalized: `(N,)` whether each agent is hospitalized.
+        deceased: `(N,)` whether each agent is deceased.
+        n_contagious: Number of contagious agents not parked in `EXIT`, kept up to date by `_set_status`.
+    """
+
+    scenario: SIRScenario
+
+    @override
+    def __init__(self, scenario: SIRScenario, agents: list[SIRAgent]) -> None:
+        super().__init__(scenario, agents)
+        self.prevention_index = np.array([p.prevention_index for p in agents], dtype=np.float64)
+        self.age = np.array([p.age for p in agents], dtype=np.int8)
+        self.susceptibility = np.array([p.susceptibility for p in agents], dtype=np.float64)
+        self.severity = np.array([p.severity for p in agents], dtype=np.float64)
+        self.long_covid = np.array([p.long_covid for p in agents], dtype=bool)
+        self.infected = np.array([p.infected for p in agents], dtype=bool)
+        self.hospitalized = np.array([p.hospitalized for p in agents], dtype=bool)
+        self.deceased = np.array([p.deceased for p in agents], dtype=bool)
+        self.n_contagious = int((np.isin(self.status, CONTAGIOUS) & ~self.exited).sum())
+
+        index = {id(p): i for i, p in enumerate(agents)}
+        self.scenario.timeline.remap(lambda p: index[id(p)])
+
+    def summarize_agent_info(self) -> np.typing.NDArray:
+        """Summarize agent information for saving as rows of the agent info table."""
+        ret = np.empty(self.n, dtype=AGENT_INFO_DTYPE)
+        ret['age'] = self.age
+        ret['sex'] = self.random.choice([b'M', b'F'], self.n)
+        ret['long_covid'] = self.long_covid
+        ret['prevention_index'] = self.prevention_index
+        ret['mask'] = [info.mask_label for info in self.info]
+        ret['vax'] = [info.vax_label for info in self.info]
+        ret['infected'] = self.infected
+        ret['hospitalized'] = self.hospitalized
+        ret['deceased'] = self.deceased
+        ret['capacity'] = self.size
+        return ret
+
+    def recover(self) -> None:
+        """Applies the disease progression events due on the current time step."""
+        if not (due := self.scenario.timeline.pop_due(self.scenario.tick)):
+            return
+        idx, events = (np.array(x) for x in zip(*due))
+
+        tasks: list[tuple[int, str]] = []
+        for i in idx[events == QUARANTINE].tolist():
+            if self.status[i] not in CONTAGIOUS:
+                continue
+            if self.hospitalized[i]:
+                self._set_status(i, HOSPITALIZED)
+                tasks.append((i, 'EXIT'))
+            elif self.deceased[i]:
+                self._set_status(i, DECEASED)
+                tasks.append((i, 'EXIT'))
+            elif self.status[i] != QUARANTINED:
+                self._set_status(i, QUARANTINED)
+                tasks.append((i, 'HOME'))
+        self.set_tasks(np.array([i for i, _ in tasks], dtype=np.intp), [zone for _, zone in tasks])
+
+        recovered = idx[events == RECOVERY]
+        recovered = recovered[np.isin(self.status[recovered], CONTAGIOUS)]
+        self._set_status(recovered, RECOVERED)
+
+    def _set_status(self, idx: int | np.typing.NDArray[np.intp], status: int) -> None:
+        """Set the status of agents `idx`, counting the present agents who become or stop being contagious."""
+        present = ~self.exited[idx]
+        was = np.isin(self.status[idx], CONTAGIOUS) & present
+        self.n_contagious += int(np.sum((status in CONTAGIOUS) & present) - np.sum(was))
+        self.status[idx] = status
+
+    @override
+    def _set_exited(self, idx: np.typing.NDArray[np.intp], exited: bool) -> None:
+        contagious = np.isin(self.status[idx], CONTAGIOUS)
+        self.n_contagious += int(np.sum(contagious & self.exited[idx]) - np.sum(contagious & ~self.exited[idx]))
+        super()._set_exited(idx, exited)
+
+    def _sample_outcome(self, idx: np.typing.NDArray[np.intp]) -> None:
+        """Sample the disease progression of newly infected agents `idx` and schedule their events."""
+        if not (n := len(idx)):
+            return
+        dist = SIRAgent.dist
+
+        # days before showing symptoms, asymptomatic agents do not quarantine
+        n_days_q = np.where(self.random.random(n) < 0.17, 100, self.random.lognormal(*dist['presymptomatic'], n))
+
+        # days before recovery
+        deceased = self.random.random(n) < 0.02
+        hospitalized = ~deceased & (self.random.random(n) < 0.30 * self.severity[idx])
+        n_days_r = np.where(
+            hospitalized,
+            self.random.lognormal(*dist['severe'], n),
+            self.random.lognormal(*dist['mild'], n),
+        )
+        n_days_q[deceased | hospitalized] = self.random.lognormal(*dist['presymptomatic'], n)[deceased | hospitalized]
+
+        long_covid = self.random.random(n) < 0.16
+        n_days_r[long_covid] *= 3
+
+        self.deceased[idx] |= deceased
+        self.hospitalized[idx] |= hospitalized
+        self.long_covid[idx] |= long_covid
+
+        tick = self.scenario.tick
+        quarantine = tick + self.scenario.days_to_ticks(n_days_q)
+        recovery = tick + self.scenario.days_to_ticks(n_days_r)
+        for i, q, r, dead in zip(idx.tolist(), quarantine.tolist(), recovery.tolist(), deceased.tolist()):
+            self.scenario.timeline.push(q, QUARANTINE, i)
+            if not dead:
+                self.scenario.timeline.push(r, RECOVERY, i)
+
+    def check_schedule(self) -> None:
+        """Start the tasks scheduled for the current minute."""
+        if (due := self.schedule_index.get(self.scenario.now)) is None:
+            return
+
+        minute = self.scenario.minute
+        due = due[~np.isin(self.status[due], EXCLUDE) & (self.last_action_time[due] != minute)]
+        self.last_action_time[due] = minute
+        self.set_tasks(due, [self.schedules[i][self.scenario.now] for i in due.tolist()])
+
+    def quiescent_ticks(self) -> int:
+        """Number of upcoming time steps in which nothing can change, `0` if the next one is not quiescent.
+
+        The population is quiescent when no agent is moving, no present agent is contagious and the
+        virus field is clean, until the next wake-up, scheduled action or disease progression event.
+        """
+        if len(self.moving) or self._started or self.n_contagious or not self.scenario.is_clean:
+            return 0
+        return max(self.next_event_tick() - self.scenario.tick, 0)
+
+    def _droplet_expose(self, idx: np.typing.NDArray[np.intp]) -> None:
+        """Simulates infection of agents `idx` due to residue disease in the air."""
+        virus_level = self.scenario.virus_levels(self.cell[idx])
+        exposed = virus_level > 1
+        idx, virus_level = idx[exposed], virus_level[exposed]
+
+        atk = self.scenario.virus.attack_rate
+        v_scale = virus_level / VIRUS_SCALE
+        t_scale = self.scenario.sim.t_step / 3600  # per hour
+
+        # exposure and prevention draws for every agent in a single call
+        draws = self.random.random((2, len(idx)))
+        infected = (draws[0] < atk * v_scale * t_scale * self.susceptibility[idx]) & (
+            draws[1] > self.prevention_index[idx]
+        )
+        self._sample_outcome(idx[infected])
+        self._set_status(idx[infected], INFECTED)
+        self.infected[idx[infected]] = True
+
+    def _droplet_spread(self, idx: np.typing.NDArray[np.intp], fraction: float = 1.0) -> None:
+        """Causes the areas currently occupied by agents `idx` to be at risk of disease.
+
+        Args:
+            idx: Indices of the contagious agents.
+            fraction: Fraction of the per time step viral load to deposit.
+        """
+        viral_load = fraction * VIRUS_SCALE * (1 - self.prevention_index[idx])
+        self.scenario.contaminate_many(self.cell[idx], viral_load)
+
+    @override
+    def step(self) -> None:
+        """Movement decision making for the whole population."""
+        self.recover()
+        if self.scenario.check_schedule:
+            self.check_schedule()
+
+        idle = self.advance()
+        exited = self.in_('EXIT', idle)
+        self.park(idle[exited])
+        present = ~self.exited
+        idle = idle[~exited]
+        home = self.in_('HOME', idle)
+        wait = 300 // self.scenario.sim.t_step
+        self.set_wait(idle[home], wait)
+
+        idle = idle[~home]
+        outing = self.random.random(len(idle)) < 0.5
+        self.set_tasks(idle[outing], 'OPEN')
+        self.set_wait(idle[~outing], wait)
+
+        # Agents stepped one at a time see the deposits of the contagious agents stepped before them,
+        # so half of this step's viral load is deposited ahead of exposure to match on average.
+        contagious = np.flatnonzero(present & np.isin(self.status, CONTAGIOUS))
+        self._droplet_spread(contagious, fraction=0.5)
+        self._droplet_expose(np.flatnonzero(present & (self.status == SUSCEPTIBLE)))
+        self._droplet_spread(contagious, fraction=0.5)
@@ -1,6 +1,6 @@
 """Import entrypoint for the scenario module."""
 
-from simulation.scenario.base import VIRUS_SCALE, BaseScenario
+from simulation.scenario.base import MINUTES_PER_DAY, VIRUS_SCALE, BaseScenario
 from simulation.scenario.sir import SIRScenario
 
-__all__ = ['BaseScenario', 'SIRScenario', 'VIRUS_SCALE']
+__all__ = ['BaseScenario', 'SIRScenario', 'MINUTES_PER_DAY', 'VIRUS_SCALE']
@@ -1,14 +1,19 @@
 """Tools for managing simulation scenario data and configuration."""
 
-import datetime as dt
 from abc import ABC
+from datetime import datetime, timedelta
 
 import numpy as np
+from loguru import logger
 
-from simulation.pathing import GraphGrid, OptimizedPathfinder
+from simulation.pathing import DistanceFields, GraphGrid, OptimizedPathfinder
+from simulation.timeline import Timeline
+from utilities.types.agent import AgentState
+from utilities.types.pathing import CellPath, Coordinate
 from utilities.types.scenario import ScenarioSpec
 
 VIRUS_SCALE = 2**14
+MINUTES_PER_DAY = 24 * 60
 
 
 class BaseScenario(ABC):
@@ -18,10 +23,20 @@ class BaseScenario(ABC):
         sim: Simulation object.
         virus: Virus object.
         prevention: Prevention index object.
-        dt: DateTime object for simulation time.
-        now: Current time in HH:MM format.
+        start: DateTime object for the start of the simulation.
+        tick: Number of time steps simulated so far.
+        minute: Minutes elapsed since midnight of the start day.
+        now: Current minute of the day.
         check_schedule: Boolean to check schedule.
+        timeline: Calendar of scheduled agent disease progression events.
+        dirty_lo: `(2, Z)` lowest `(x, y)` of the active virus region on each floor.
+        dirty_hi: `(2, Z)` highest `(x, y)` of the active virus region on each floor, `-1` if the floor is clean.
+        staged: Virus deposited since the last fused ventilation, `None` unless ventilation is fused.
+        quantized: Whether the virus field stores whole units of viral concentration.
+        random: Random number generator of the scenario, e.g. for the stochastic rounding of reduced precision virus.
         graph: Optimized pathfinder object for pathfinding.
+        path_requests: Agent states waiting for a path to a coordinate, resolved together by `resolve_paths`.
+        fields: Zone distance fields of the map, `None` unless vectorized agents navigate with them.
     """
 
     def __init__(self, spec: ScenarioSpec, load_optimized_graph: bool = True) -> None:
@@ -29,28 +44,152 @@ class BaseScenario(ABC):
 
         Args:
             spec: Specification object containing simulation parameters.
-            load_optimized_graph: Boolean to use optimized graph for pathfinding.
+            load_optimized_graph: Boolean to use the optimized graph built for the map, if any, for pathfinding.
         """
         self.sim = spec.sim
         self.virus = spec.virus
         self.prevention = spec.prevention
-        self.dt = dt.datetime(2024, 5, 1, 7)
-        self.now = self.dt.strftime('%H:%M')
+        self.start = datetime(2024, 5, 1, 7)
+        self.tick = 0
+        self._offset = self.start.hour * 3600 + self.start.minute * 60 + self.start.second
+        self.minute = self._offset // 60
+        self.now = self.minute % MINUTES_PER_DAY
         self.check_schedule = True
+        self.timeline = Timeline()
+        self.dirty_lo = np.empty((2, self.sim.shape[2]), dtype=np.int64)
+        self.dirty_hi = np.empty((2, self.sim.shape[2]), dtype=np.int64)
+        self.clear_dirty()
+        self.staged = np.zeros_like(self.virus.matrix) if self.sim.ventilation_substeps > 1 else None
+        self.quantized = np.issubdtype(self.virus.matrix.dtype, np.integer)
+        self.random = np.random.default_rng()
+        self.path_requests: list[tuple[AgentState, Coordinate]] = []
 
-        if load_optimized_graph:
-            self.graph = OptimizedPathfinder.load('bsf')
+        name = OptimizedPathfinder.map_name(self.sim.mapfile)
+        if load_optimized_graph and OptimizedPathfinder.file(name).exists():
+            self.graph = OptimizedPathfinder.load(name)
         else:
+            if load_optimized_graph and (legacy := OptimizedPathfinder.legacy_file(name)) is not None:
+                logger.warning(
+                    f'Ignoring {legacy}, saved by an earlier version: convert it with '
+                    '`python build_paths.py <config> --legacy` to use the optimized pathfinder.'
+                )
             self.construct_graph()
 
+        self.fields = None
+        if self.sim.vectorized and self.sim.navigation == 'fields':
+            self.fields = DistanceFields.for_setup(self.sim)
+
+    @property
+    def dt(self) -> datetime:
+        """DateTime object for the current simulation time."""
+        return self.start + timedelta(seconds=self.tick * self.sim.t_step)
+
+    def step_clock(self, ticks: int = 1) -> None:
+        """Advance the simulation clock by `ticks` time steps and flag minute changes."""
+        self.tick += ticks
+        minute = (self._offset + self.tick * self.sim.t_step) // 60
+        self.check_schedule = minute != self.minute
+        if self.check_schedule:
+            self.minute = minute
+            self.now = minute % MINUTES_PER_DAY
+
+    def tick_of_minute(self, minute: int) -> int:
+        """First tick falling on or after `minute` minutes since midnight of the start day."""
+        return -((self._offset - minute * 60) // self.sim.t_step)
+
+    def get_state(self) -> dict:
+        """Dynamic state of the scenario saved in model checkpoints: clock, timeline, virus field and random state."""
+        return {
+            'tick': self.tick,
+            'check_schedule': self.check_schedule,
+            'timeline': self.timeline,
+            'matrix': self.virus.matrix,
+            'staged': self.staged,
+            'dirty': (self.dirty_lo, self.dirty_hi),
+            'random': self.random.bit_generator.state,
+        }
+
+    def set_state(self, state: dict) -> None:
+        """Restore the dynamic state of the scenario from `get_state()` of a scenario of the same setup."""
+        if state['matrix'].shape != self.virus.matrix.shape or state['matrix'].dtype != self.virus.matrix.dtype:
+            raise ValueError(
+                f'Checkpoint virus field {state["matrix"].dtype}{state["matrix"].shape} does not match '
+                f'the scenario virus field {self.virus.matrix.dtype}{self.virus.matrix.shape}.'
+            )
+        self.tick = state['tick']
+        self.minute = (self._offset + self.tick * self.sim.t_step) // 60
+        self.now = self.minute % MINUTES_PER_DAY
+        self.check_schedule = state['check_schedule']
+        self.timeline = state['timeline']
+        self.virus.matrix[...] = state['matrix']
+        if self.staged is not None:
+            self.staged[...] = 0 if state['staged'] is None else state['staged']
+        elif state['staged'] is not None:
+            # virus staged for a fused ventilation is folded into the field of unfused scenarios
+            staged = state['staged'].reshape(-1)
+            cells = np.flatnonzero(staged)
+            self._deposit(self.virus.matrix, cells, staged[cells])
+        self.dirty_lo[...], self.dirty_hi[...] = state['dirty']
+        self.random.bit_generator.state = state['random']
+
+    @property
+    def is_clean(self) -> bool:
+        """Whether the virus field is free of virus on every floor."""
+        return bool((self.dirty_hi[0] < 0).all())
+
     def construct_graph(self) -> None:
         """Generate a classic graph for pathfinding."""
-        valid_nodes = np.argwhere(self.sim.masks['VALID'])
-        stair_nodes = np.argwhere(self.sim.masks['STAIRS'] & self.sim.masks['TRANSIT_NODES'])
-        self.graph = GraphGrid(valid_nodes, r=1, spacing={2: 2})
-        stairs = GraphGrid(stair_nodes, r=1, spacing={0: 2, 1: 2})
-        self.graph.add_edges(stairs, transform=True)
-        self.graph.build()
+        self.graph = GraphGrid.from_setup(self.sim)
+
+    def days_to_ticks(self, days: float | np.typing.NDArray) -> int | np.typing.NDArray:
+        """Convert durations in days to whole numbers of time steps, rounding up."""
+        ticks = np.ceil(np.multiply(days, 24 * 60 * 60 / self.sim.t_step)).astype(np.int64)
+        return ticks if ticks.ndim else int(ticks)
+
+    def to_cell(self, pos: Coordinate) -> int:
+        """Convert coordinate `(x,y,z)` to a flat cell index."""
+        _, ny, nz = self.sim.shape
+        x, y, z = pos
+        return (x * ny + y) * nz + z
+
+    def to_coord(self, cell: int) -> Coordinate:
+        """Convert a flat cell index to coordinate `(x,y,z)`."""
+        _, ny, nz = self.sim.shape
+        xy, z = divmod(int(cell), nz)
+        x, y = divmod(xy, ny)
+        return x, y, z
+
+    def pathfind(self, start: Coordinate, end: Coordinate) -> CellPath:
+        """Compute the shortest path between two coordinates as flat cell indices."""
+        return self.pathfind_many([start], [end])[0]
+
+    def pathfind_many(self, starts: list[Coordinate], ends: list[Coordinate]) -> list[CellPath]:
+        """Compute the shortest paths between pairs of coordinates as flat cell indices.
+
+        On the grid graph, the paths to the same destination are extracted from one shortest path tree.
+        """
+        if isinstance(self.graph, OptimizedPathfinder):
+            return [self.graph.pathfind_cells(self.to_cell(s), self.to_cell(e)) for s, e in zip(starts, ends)]
+        vertex = self.graph.vertex
+        paths = self.graph.pathfind_many([vertex[s] for s in starts], [vertex[e] for e in ends])
+        return [np.ravel_multi_index(self.graph.nodes[path].T, self.sim.shape).astype(np.int32) for path in paths]
+
+    def request_path(self, state: AgentState, end: Coordinate) -> None:
+        """Queue a path from the position of agent `state` to `end`, set by the next `resolve_paths`."""
+        self.path_requests.append((state, end))
+
+    def resolve_paths(self) -> None:
+        """Set the paths of the queued requests, the latest request of an agent taking precedence.
+
+        Agents whose destination is unreachable get no path and wait in place instead.
+        """
+        if not (requests := self.path_requests):
+            return
+        self.path_requests = []
+        states, ends = zip(*requests)
+        for state, path in zip(states, self.pathfind_many([state.pos for state in states], list(ends))):
+            state.path = path if len(path) else None
+            state.cursor = 0
 
     def get_idx(self, zone: str) -> tuple[int, int, int]:
         """Get random `(x,y,z)` coordinate from terrain mask."""
@@ -60,8 +199,66 @@ class BaseScenario(ABC):
 
     def virus_level(self, x: int, y: int, z: int) -> float:
         """Return viral concentration value at coordinate `(x,y,z)`."""
-        return self.virus.matrix[x, y, z]
+        level = float(self.virus.matrix[x, y, z])
+        if self.staged is not None:
+            return min(level + float(self.staged[x, y, z]), VIRUS_SCALE)
+        return level
 
     def contaminate(self, x: int, y: int, z: int, concentration: float = VIRUS_SCALE) -> None:
         """Set viral concentration at coordinate `(x,y,z)`."""
-        self.virus.matrix[x, y, z] += concentration
+        field = self.virus.matrix if self.staged is None else self.staged
+        if field.dtype == np.float32:
+            field[x, y, z] += concentration
+        else:
+            self._deposit(field, np.ravel_multi_index(([x], [y], [z]), self.sim.shape), np.array([concentration]))
+        self.dirty_lo[:, z] = np.minimum(self.dirty_lo[:, z], (x, y))
+        self.dirty_hi[:, z] = np.maximum(self.dirty_hi[:, z], (x, y))
+
+    def virus_levels(self, cells: np.typing.NDArray) -> np.typing.NDArray:
+        """Return viral concentration values at flat cell indices `cells`."""
+        levels = self.virus.matrix.reshape(-1)[cells].astype(np.float32, copy=False)
+        if self.staged is not None:
+            levels += self.staged.reshape(-1)[cells]
+        return levels if self.staged is None else np.minimum(levels, VIRUS_SCALE)
+
+    def contaminate_many(self, cells: np.typing.NDArray, concentration: np.typing.NDArray) -> None:
+        """Add viral concentrations at flat cell indices `cells`, accumulating repeated cells."""
+        self._deposit(self.virus.matrix if self.staged is None else self.staged, cells, concentration)
+        self.mark_dirty(cells)
+
+    def _deposit(self, field: np.typing.NDArray, cells: np.typing.NDArray, concentration: np.typing.NDArray) -> None:
+        """Add `concentration` to `field` at flat cell indices `cells`, saturating reduced precision fields."""
+        flat = field.reshape(-1)
+        if flat.dtype == np.float32:
+            np.add.at(flat, cells, concentration)
+            return
+
+        cells, inverse = np.unique(cells, return_inverse=True)
+        total = flat[cells] + np.bincount(inverse, concentration, len(cells))
+        if self.quantized:
+            flat[cells] = np.minimum(np.rint(total), np.iinfo(flat.dtype).max)
+        else:
+            flat[cells] = np.minimum(total, np.finfo(flat.dtype).max)
+
+    def virus_frame(self) -> np.typing.NDArray:
+        """Return the viral concentration of the whole map as saved in verbose frames.
+
+        Reduced precision fields are saved as stored, without conversion, and float32 fields as
+        whole units in int16, so frames always take half the memory of a float32 copy.
+        """
+        if self.virus.matrix.dtype == np.float32:
+            return self.virus.matrix.astype(np.int16)
+        return self.virus.matrix.copy()
+
+    def mark_dirty(self, cells: np.typing.NDArray) -> None:
+        """Grow the active virus region of each floor to include flat cell indices `cells`."""
+        *_, x, y, z = np.unravel_index(cells, self.virus.matrix.shape)
+        np.minimum.at(self.dirty_lo[0], z, x)
+        np.minimum.at(self.dirty_lo[1], z, y)
+        np.maximum.at(self.dirty_hi[0], z, x)
+        np.maximum.at(self.dirty_hi[1], z, y)
+
+    def clear_dirty(self, z: int | slice = slice(None)) -> None:
+        """Mark floor `z` (default all floors) as free of virus."""
+        self.dirty_lo[:, z] = np.iinfo(np.int64).max
+        self.dirty_hi[:, z] = -1
@@ -1,32 +1,194 @@
 """SIR scenario simulation class."""
 
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import override
+
 import numpy as np
 from scipy.ndimage import gaussian_filter
 
 from simulation.scenario.base import VIRUS_SCALE, BaseScenario
+from utilities.types.scenario import ScenarioSpec
+
+TRUNCATE = 2.0
+
+
+def _ventilate(
+    field: np.typing.NDArray, barrier: np.typing.NDArray, sigma: float, decay: float, max_: float
+) -> np.typing.NDArray:
+    """Ventilate a copy of the whole virus `field` for reference."""
+    sigma = (0,) * (field.ndim - 3) + (sigma, sigma, 0)
+    ret = gaussian_filter(field, sigma=sigma, mode='constant', truncate=TRUNCATE)
+    ret[..., barrier] = 0
+    ret *= decay
+    return np.clip(ret, 0, max_, out=ret)
+
+
+def _stochastic_round(
+    values: np.typing.NDArray[np.float32], dtype: np.dtype, rng: np.random.Generator
+) -> np.typing.NDArray:
+    """Round non-negative `values` to the `dtype` value below or above each, the nearer the likelier.
+
+    Unlike rounding to nearest, the expected rounded value is the value itself, so small decays are not lost.
+    `values` are overwritten. Floating point values below the normal range of `dtype` are rounded to nearest.
+    """
+    if np.issubdtype(dtype, np.integer):
+        values += rng.random(values.shape, dtype=np.float32)
+        return np.floor(values, out=values)
+
+    # random carries into the float32 mantissa bits below the precision of `dtype`, which are then dropped
+    dropped = np.finfo(np.float32).nmant - np.finfo(dtype).nmant
+    bits = values.view(np.uint32)
+    bits += rng.integers(1 << dropped, size=values.shape, dtype=np.uint32)
+    bits >>= dropped
+    bits <<= dropped
+    return values.astype(dtype)
 
 
 class SIRScenario(BaseScenario):
-    """Subclassed scenario for SIR simulation."""
+    """Subclassed scenario for SIR simulation.
 
-    def ventilate(self, sigma: float = 0.459, max_: float = VIRUS_SCALE) -> None:
+    Ensembles hold one virus field per replicate along a leading axis, which the
+    Gaussian kernel does not extend over, and share a single active region.
+
+    Floors are ventilated on a thread pool of `sim.ventilation_workers` threads, created
+    on first use and shut down by `close`, or once the scenario is garbage collected.
+    It is left out of the pickled scenario.
+    """
+
+    @override
+    def __init__(self, spec: ScenarioSpec, load_optimized_graph: bool = True) -> None:
+        super().__init__(spec, load_optimized_graph)
+        self._pool: ThreadPoolExecutor | None = None
+        self._shutdown: weakref.finalize | None = None
+
+    def __getstate__(self) -> dict:
+        """Pickle the scenario without its thread pool."""
+        return self.__dict__ | {'_pool': None, '_shutdown': None}
+
+    def _executor(self) -> ThreadPoolExecutor:
+        """Thread pool ventilating the floors in parallel, created on first use."""
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.sim.ventilation_workers, thread_name_prefix='ventilate')
+            self._shutdown = weakref.finalize(self, self._pool.shutdown)
+        return self._pool
+
+    def close(self) -> None:
+        """Shut down the ventilation thread pool, if any, a new one being created if ventilating again."""
+        if self._shutdown is not None:
+            self._shutdown()
+            self._pool = self._shutdown = None
+
+    def ventilate(self, sigma: float = 0.459, max_: float = VIRUS_SCALE, threshold: float = 0.01) -> None:
         """Simulate the ventilation of the map.
 
+        Only the bounding box of non-zero virus on each floor, grown by the kernel radius, is
+        diffused. Floors without virus above `threshold` are skipped entirely. Floors are
+        independent, so they are spread over `sim.ventilation_workers` threads when it exceeds 1.
+
+        With `sim.ventilation_substeps` k > 1 the map is only ventilated every k time steps, with
+        the equivalent kernel of standard deviation `sigma * sqrt(k)` and the decay compounded k
+        times, after merging the virus staged in between.
+
         Args:
             sigma: Standard deviation for Gaussian kernel.
             max_: Maximum virus concentration.
+            threshold: Concentration at or below which virus outside the active region is dropped.
         """
-        gaussian_filter(
-            self.virus.matrix,
-            sigma=(sigma, sigma, 0),
-            mode='constant',
-            truncate=2.0,
-            output=self.virus.matrix,
-        )
-        self.virus.matrix[self.sim.masks['BARRIER']] = 0
-        self.virus.matrix *= self.virus.decay_factor
-        np.clip(self.virus.matrix, 0, max_, out=self.virus.matrix)
+        k = self.sim.ventilation_substeps
+        if (self.tick + 1) % k:
+            return
+        sigma, decay = sigma * np.sqrt(k), self.virus.decay_factor**k
+
+        floors = np.flatnonzero(self.dirty_hi[0] >= 0).tolist()
+        rngs = [None] * len(floors)
+        if self.virus.matrix.dtype != np.float32:
+            # one generator per floor seeded in order, so threaded floors round the same way as sequential ones
+            rngs = [np.random.default_rng(s) for s in self.random.integers(2**63, size=len(floors)).tolist()]
+        workers = min(self.sim.ventilation_workers, len(floors))
+        if workers > 1:
+            args = (sigma, decay, max_, threshold)
+            futures = [self._executor().submit(self._ventilate_floor, z, *args, rng) for z, rng in zip(floors, rngs)]
+            for future in futures:
+                future.result()
+        else:
+            for z, rng in zip(floors, rngs):
+                self._ventilate_floor(z, sigma, decay, max_, threshold, rng)
+
+    def _ventilate_floor(
+        self, z: int, sigma: float, decay: float, max_: float, threshold: float, rng: np.random.Generator | None
+    ) -> None:
+        """Diffuse, block, decay and clip the active region of floor `z` in place, rounding with `rng` if reduced."""
+        nx, ny, _ = self.sim.shape
+        radius = int(TRUNCATE * sigma + 0.5)
+        x0, y0 = np.maximum(self.dirty_lo[:, z] - radius, 0).tolist()
+        x1, y1 = np.minimum(self.dirty_hi[:, z] + radius + 1, (nx, ny)).tolist()
+
+        # reduced precision fields are ventilated in float32
+        region = self.virus.matrix[..., x0:x1, y0:y1, z]
+        work = region if region.dtype == np.float32 else region.astype(np.float32)
+        if self.staged is not None:
+            staged = self.staged[..., x0:x1, y0:y1, z]
+            work += staged
+            staged[...] = 0
+        sigma = (0,) * (work.ndim - 2) + (sigma, sigma)
+        work[...] = gaussian_filter(work, sigma=sigma, mode='constant', truncate=TRUNCATE)
+        work[..., self.sim.in_zone('BARRIER', (slice(x0, x1), slice(y0, y1), z))] = 0
+        work *= decay
+        np.clip(work, 0, max_, out=work)
+
+        if work is not region:
+            # stochastic rounding keeps the slow per step decay of small reduced precision values unbiased
+            region[...] = _stochastic_round(work, region.dtype, rng)
+        self._shrink_dirty(region, x0, y0, z, threshold)
+
+    def _shrink_dirty(self, region: np.typing.NDArray, x0: int, y0: int, z: int, threshold: float) -> None:
+        """Shrink the active region of floor `z` to the cells of `region` above `threshold`."""
+        live = (region > threshold).reshape(-1, *region.shape[-2:]).any(axis=0)
+        rows = np.flatnonzero(live.any(axis=1))
+        if not rows.size:
+            region[...] = 0
+            self.clear_dirty(z)
+            return
+
+        cols = np.flatnonzero(live.any(axis=0))
+        r0, r1, c0, c1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        keep = region[..., r0:r1, c0:c1].copy()
+        region[...] = 0
+        region[..., r0:r1, c0:c1] = keep
+
+        self.dirty_lo[:, z] = (x0 + r0, y0 + c0)
+        self.dirty_hi[:, z] = (x0 + r1 - 1, y0 + c1 - 1)
 
     def sanitize(self) -> None:
         """Simulate the sanitization of the map."""
         self.virus.matrix[:] = 0
+        if self.staged is not None:
+            self.staged[:] = 0
+        self.clear_dirty()
+
+    def fused_ventilation_error(self, substeps: int, sigma: float = 0.459, max_: float = VIRUS_SCALE) -> float:
+        """Relative error of fusing `substeps` ventilations of the current virus field into one.
+
+        The scenario is left untouched: the field is ventilated exactly `substeps` times and, separately,
+        once with the fused kernel and decay, over the whole map.
+
+        Args:
+            substeps: Number of time steps to fuse.
+            sigma: Standard deviation for Gaussian kernel of a single time step.
+            max_: Maximum virus concentration.
+
+        Returns:
+            error: L2 norm of the difference relative to the L2 norm of the exact field.
+        """
+        field = self.virus.matrix.astype(np.float32)
+        if self.staged is not None:
+            field += self.staged
+        barrier = self.sim.mask('BARRIER')
+        exact = field
+        for _ in range(substeps):
+            exact = _ventilate(exact, barrier, sigma, self.virus.decay_factor, max_)
+        fused = _ventilate(field, barrier, sigma * np.sqrt(substeps), self.virus.decay_factor**substeps, max_)
+
+        norm = np.linalg.norm(exact)
+        return float(np.linalg.norm(fused - exact) / norm) if norm else 0.0
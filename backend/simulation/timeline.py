@@ -0,0 +1,48 @@
+"""Event calendar for scheduled agent status changes."""
+
+import heapq
+from collections.abc import Callable
+from typing import Any
+
+from utilities.types.agent import AgentEvent
+
+
+class Timeline:
+    """Min-heap of agent events keyed on the integer tick they are due.
+
+    Events due on the same tick are popped in `AgentEvent` order, then in the
+    order they were pushed.
+
+    Attributes:
+        heap: Heap of `(tick, event, seq, target)` entries.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty timeline."""
+        self.heap: list[tuple[int, AgentEvent, int, Any]] = []
+        self._seq = 0
+
+    def __len__(self) -> int:
+        """Number of pending events."""
+        return len(self.heap)
+
+    def push(self, tick: int, event: AgentEvent, target: Any) -> None:
+        """Schedule `event` for `target` on `tick`."""
+        heapq.heappush(self.heap, (tick, event, self._seq, target))
+        self._seq += 1
+
+    def pop_due(self, tick: int) -> list[tuple[Any, AgentEvent]]:
+        """Pop all events due on or before `tick` as `(target, event)` pairs."""
+        due = []
+        while self.heap and self.heap[0][0] <= tick:
+            _, event, _, target = heapq.heappop(self.heap)
+            due.append((target, event))
+        return due
+
+    def next_tick(self) -> int | None:
+        """Tick of the earliest pending event, `None` if the timeline is empty."""
+        return self.heap[0][0] if self.heap else None
+
+    def remap(self, func: Callable[[Any], Any]) -> None:
+        """Replace the target of every pending event with `func(target)`."""
+        self.heap = [(tick, event, seq, func(target)) for tick, event, seq, target in self.heap]
@@ -1,5 +1,6 @@
 """Results writer subscribing to zmq publisher and writing data to hdf5 file."""
 
+import shutil
 from pathlib import Path
 from threading import Event
 from typing import override
@@ -26,17 +27,46 @@ class AgentInfo(tb.IsDescription):
     capacity = tb.Int16Col()
 
 
+AGENT_INFO_DTYPE = tb.description.dtype_from_descr(AgentInfo)
+"""Structured array dtype of the agent info table rows."""
+
+
 class Writer(SocketHandler):
-    """Writer class for receiving data over ZMQ sockets."""
+    """Writer class for receiving data over ZMQ sockets.
+
+    HDF5 files interrupted mid-write can be unreadable, so the file is closed and
+    snapshotted whenever the model is checkpointed, and resumed runs restart from
+    the snapshot.
+    """
 
     file: tb.File
     expectedrows: int
 
-    def __init__(self, filename: Path, expectedrows: int = 1000) -> None:
-        """Initialize the writer with a hdf5 file."""
+    def __init__(self, filename: Path, expectedrows: int = 1000, resume: int = 0) -> None:
+        """Initialize the writer with a hdf5 file.
+
+        Args:
+            filename: Path of the hdf5 file.
+            expectedrows: Expected number of saved iterations.
+            resume: Number of saved iterations to keep from the snapshot when resuming a run, `0` to start over.
+        """
         super().__init__()
-        self.file = tb.open_file(filename, mode='w')
+        self.filename = Path(filename)
+        self.snapshot = self.filename.with_suffix('.snapshot')
         self.expectedrows = expectedrows
+        if not resume:
+            self.file = tb.open_file(self.filename, mode='w')
+            return
+
+        if not self.snapshot.exists():
+            raise FileNotFoundError(f'{self.snapshot} does not exist, the run cannot be resumed.')
+        shutil.copyfile(self.snapshot, self.filename)
+        self.file = tb.open_file(self.filename, mode='a')
+        for node in self.file.iter_nodes(self.file.root, classname='EArray'):
+            if node.nrows < resume:
+                self.file.close()
+                raise ValueError(f'{self.snapshot} holds {node.nrows} of the {resume} iterations to resume.')
+            node.truncate(resume)
 
     def write(self, terminate: Event, port: int = 5556) -> None:
         """Function for writing data to file. Required to support saving virus topics.
@@ -48,28 +78,46 @@ class Writer(SocketHandler):
         with self.sync_socket(zmq.SUB, port):
             while not terminate.is_set():
                 topic = self.recv_string()
-                if topic in ['agents', 'virus']:
-                    data = self.recv_array().astype(np.int16)
+                if topic == 'agents':
+                    data = self.recv_array().astype(np.int16, copy=False)
                     self._append(topic, data)
+                elif topic == 'virus':
+                    # already in the reduced type of verbose frames, see `BaseScenario.virus_frame`
+                    self._append(topic, self.recv_array())
+                elif topic == 'agent_info':
+                    data = self.recv_array()
+                    table = self.file.create_table(self.file.root, 'agent_info', AgentInfo, expectedrows=len(data))
+                    table.append(data)
+                    break
                 else:
                     data = self.recv_pyobj()
                     if topic == 'timesteps':
                         self._append(topic, np.array(data))
-                    elif topic == 'agent_info':
-                        table = self.file.create_table(self.file.root, 'agent_info', AgentInfo)
-                        agent_info = table.row
-                        for agent in data:
-                            for key, value in agent.items():
-                                agent_info[key] = value
-                            agent_info.append()
-                        break
+                    elif topic == 'checkpoint':
+                        self._checkpoint(data['path'], data['state'])
 
         self.file.close()
+        self.snapshot.unlink(missing_ok=True)
+
+    def _checkpoint(self, path: Path, state: bytes) -> None:
+        """Snapshot the file, then save the model checkpoint taken once the iterations written so far were sent.
+
+        The snapshot is replaced first, so it always holds at least the iterations of the latest checkpoint.
+        """
+        self.file.close()
+        tmp = self.snapshot.with_name(f'{self.snapshot.name}.tmp')
+        shutil.copyfile(self.filename, tmp)
+        tmp.replace(self.snapshot)
+        tmp = path.with_name(f'{path.name}.tmp')
+        tmp.write_bytes(state)
+        tmp.replace(path)
+        self.file = tb.open_file(self.filename, mode='a')
 
     def _append(self, topic: str, data: np.typing.NDArray) -> None:
         """Append data to EArray, creating array if required."""
         data = np.expand_dims(data, axis=(0))
         if topic not in self.file.root:
+            # the array is created holding `data`
             self.file.create_earray(
                 self.file.root,
                 name=topic,
@@ -77,8 +125,8 @@ class Writer(SocketHandler):
                 expectedrows=self.expectedrows,
                 filters=tb.Filters(complevel=9, complib='blosc2'),
             )
-
-        self.file.root[topic].append(data)
+        else:
+            self.file.root[topic].append(data)
 
     @override
     def configure_socket(self, port: int) -> None:
@@ -88,3 +136,4 @@ class Writer(SocketHandler):
         self.socket.setsockopt(zmq.SUBSCRIBE, b'agent_info')
         self.socket.setsockopt(zmq.SUBSCRIBE, b'virus')
         self.socket.setsockopt(zmq.SUBSCRIBE, b'timesteps')
+        self.socket.setsockopt(zmq.SUBSCRIBE, b'checkpoint')
@@ -0,0 +1,88 @@
+"""Tests of the virus ventilation of the SIR scenario."""
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+from matplotlib import image
+
+from simulation.scenario import VIRUS_SCALE, SIRScenario
+from utilities.types.scenario import ScenarioSpec
+
+# ventilation substeps dividing the save resolution, the ones fused ventilation supports
+SAVE_RESOLUTION = 12
+SUBSTEPS = [k for k in range(1, SAVE_RESOLUTION + 1) if SAVE_RESOLUTION % k == 0]
+
+
+def _scenario(mapfile: Path, substeps: int = 1) -> SIRScenario:
+    """Scenario on `mapfile`, an open room split by a wall with a doorway."""
+    spec = {
+        'name': 'test',
+        'sim': {
+            'name': 'test',
+            'mapfile': str(mapfile),
+            'shape': None,
+            'xy_scale': 10,
+            'save_resolution': SAVE_RESOLUTION,
+            'ventilation_substeps': substeps,
+            'terrain': [
+                {'name': 'OPEN', 'value': '#ffffff', 'color': '#ffffff'},
+                {'name': 'WALL', 'value': '#000000', 'color': '#000000', 'walkable': False},
+            ],
+        },
+        'virus': {'name': 'virus', 'attack_rate': 1.0, 'infection_rate': 0.1, 'matrix': None, 'decay_factor': None},
+        'prevention': {'name': 'none', 'vax': {'NONE': [0.0]}, 'mask': {'NONE': 0.0}},
+    }
+    return SIRScenario(ScenarioSpec.from_dict(spec), load_optimized_graph=False)
+
+
+@pytest.fixture
+def mapfile(tmp_path: Path) -> Path:
+    """Map of a 60 x 80 room split by a wall with a doorway."""
+    img = np.ones((60, 80, 3))
+    img[30, :40] = img[30, 44:] = 0
+    path = tmp_path / 'room.png'
+    image.imsave(path, img)
+    return path
+
+
+@pytest.fixture
+def scenario(mapfile: Path) -> SIRScenario:
+    """Scenario whose virus field was shed by agents walking around for a while and ventilated exactly."""
+    ret = _scenario(mapfile)
+    rng = np.random.default_rng(0)
+    valid = np.flatnonzero(ret.sim.mask('VALID'))
+    cells = rng.choice(valid, 10)
+    for _ in range(200):
+        cells = np.clip(cells + rng.integers(-1, 2, 10) * ret.sim.shape[1], valid[0], valid[-1])
+        ret.contaminate_many(cells, np.full(10, 0.05 * VIRUS_SCALE))
+        ret.ventilate()
+    return ret
+
+
+@pytest.mark.parametrize('substeps', SUBSTEPS)
+def test_fused_ventilation_error(scenario: SIRScenario, substeps: int) -> None:
+    """Fusing the supported numbers of substeps stays close to ventilating every time step."""
+    field = scenario.virus.matrix.copy()
+    error = scenario.fused_ventilation_error(substeps)
+    print(f'substeps={substeps} error={error:.2%}')
+
+    assert (scenario.virus.matrix == field).all()
+    assert error == 0 if substeps == 1 else 0 < error < 0.05
+
+
+def test_fused_ventilation_matches_error(mapfile: Path) -> None:
+    """A scenario fusing ventilations departs from exact ventilation by the error `fused_ventilation_error` reports."""
+    k = 6
+    exact, fused = _scenario(mapfile), _scenario(mapfile, substeps=k)
+    cells = np.ravel_multi_index(([10, 15, 45], [20, 60, 42], [0, 0, 0]), exact.sim.shape)
+    for s in (exact, fused):
+        s.contaminate_many(cells, np.full(3, VIRUS_SCALE / 2))
+    expected = exact.fused_ventilation_error(k)
+
+    for _ in range(k):
+        for s in (exact, fused):
+            s.ventilate()
+            s.step_clock()
+    diff = np.linalg.norm(fused.virus.matrix - exact.virus.matrix) / np.linalg.norm(exact.virus.matrix)
+    assert diff == pytest.approx(expected, rel=1e-3)
@@ -0,0 +1,40 @@
+"""Counters of simulation internals reported by the profiler."""
+
+import weakref
+from dataclasses import dataclass
+
+_CACHES: weakref.WeakSet['CacheStats'] = weakref.WeakSet()
+
+
+@dataclass(eq=False)
+class CacheStats:
+    """Hit and miss counts of a cache, reported by the profiler along with the function stats.
+
+    Attributes:
+        name: Name of the cache in the profiler report.
+        hits: Number of lookups served from the cache.
+        misses: Number of lookups computed and added to the cache.
+    """
+
+    name: str
+    hits: int = 0
+    misses: int = 0
+
+    def __post_init__(self) -> None:
+        """Register the cache for the profiler report."""
+        _CACHES.add(self)
+
+    def __setstate__(self, state: dict) -> None:
+        """Register unpickled caches for the profiler report."""
+        self.__dict__.update(state)
+        _CACHES.add(self)
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of the lookups served from the cache."""
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+
+
+def registered_caches() -> list[CacheStats]:
+    """Stats of the live caches of the process."""
+    return list(_CACHES)
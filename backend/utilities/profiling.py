@@ -8,6 +8,7 @@ from typing import Any, get_args
 import yappi
 from loguru import logger
 
+from utilities.counters import registered_caches
 from utilities.logging import Redirector
 from utilities.types.system import Filter, SortOrder, Stat
 
@@ -68,6 +69,12 @@ class Profiler:
                     for stat in sorted(stats._as_list, key=lambda x: getattr(x, sort_by), reverse=sort_order == 'desc'):
                         logger.profiler(self.format(stat))
 
+            for cache in registered_caches():
+                if cache.hits or cache.misses:
+                    logger.info(
+                        f'{cache.name} cache: {cache.hits} hits, {cache.misses} misses ({cache.hit_rate:.1%} hit rate)'
+                    )
+
     @staticmethod
     def format(stat: yappi.YFuncStat) -> dict[str, str]:
         """Apply formatting to yappi function stats."""
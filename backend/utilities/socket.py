@@ -37,17 +37,21 @@ class SocketHandler(ABC):
         return self.socket.recv_pyobj(*args, **kwargs)
 
     def send_array(self, data: np.typing.NDArray) -> None:
-        """Send a numpy array with metadata."""
-        metadata = {'dtype': str(data.dtype), 'shape': data.shape}
+        """Send a numpy array, possibly structured, with metadata."""
+        metadata = {'dtype': np.lib.format.dtype_to_descr(data.dtype), 'shape': data.shape}
         self.socket.send_json(metadata, 0 | zmq.SNDMORE)
-        self.socket.send(data)
+        self.socket.send(np.ascontiguousarray(data))
 
     def recv_array(self) -> np.typing.NDArray:
         """Reconstruct a numpy array from buffer and metadata."""
         metadata = self.socket.recv_json()
         msg = self.socket.recv()
         buffer = memoryview(msg)
-        data = np.frombuffer(buffer, dtype=metadata['dtype'])
+        dtype = metadata['dtype']
+        if isinstance(dtype, list):
+            # fields of structured arrays are serialized as lists
+            dtype = [tuple(field) for field in dtype]
+        data = np.frombuffer(buffer, dtype=np.dtype(dtype))
         return data.reshape(metadata['shape'])
 
     @contextmanager
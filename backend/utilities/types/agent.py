@@ -2,14 +2,14 @@
 
 from __future__ import annotations
 
-import datetime as dt
-from collections import deque
-from dataclasses import dataclass, field
-from enum import Enum
+from dataclasses import dataclass, field, replace
+from enum import Enum, IntEnum
 from typing import override
 
 import dacite
 
+from utilities.types.pathing import CellPath
+
 
 class AgentStatus(Enum):
     """Infection status of the Agents.
@@ -33,6 +33,18 @@ class AgentStatus(Enum):
     UNKNOWN = 7
 
 
+class AgentEvent(IntEnum):
+    """Scheduled disease progression events of the Agents.
+
+    Attributes:
+        QUARANTINE: The agent shows symptoms and quarantines, is hospitalized, or dies.
+        RECOVERY: The agent recovers from the infection.
+    """
+
+    QUARANTINE = 1
+    RECOVERY = 2
+
+
 @dataclass
 class AgentInfo:
     """General agent information.
@@ -61,20 +73,42 @@ class AgentInfo:
     access_level: int = 0
     urgency: float = 1.0
 
+    def compile_schedule(self) -> dict[int, str]:
+        """Convert the `HH:MM` keyed schedule to one keyed on minute of the day."""
+        ret = {}
+        for time, zone in self.schedule.items():
+            hours, minutes = time.split(':')
+            ret[int(hours) * 60 + int(minutes)] = zone
+        return ret
+
+    @property
+    def mask_label(self) -> str:
+        """Mask label used in the saved agent summary."""
+        return 'nomask' if self.mask_type == 'NONE' else self.mask_type.lower()
+
+    @property
+    def vax_label(self) -> str:
+        """Vaccination label used in the saved agent summary."""
+        if self.vax_doses == 0:
+            return 'novax'
+        elif self.vax_doses == 1:
+            return '1dose'
+        return self.vax_type.lower()
+
 
 @dataclass
 class AgentTime:
     """Temporal agent information.
 
     Attributes:
-        recovery: Time of recovery.
-        quarantine: Time of quarantine.
-        last_action_time: Last action time of the agent.
+        recovery: Tick of recovery.
+        quarantine: Tick of quarantine.
+        last_action_time: Minute of the last scheduled action of the agent.
     """
 
-    recovery: dt.datetime | None = None
-    quarantine: dt.datetime | None = None
-    last_action_time: str | None = None
+    recovery: int | None = None
+    quarantine: int | None = None
+    last_action_time: int | None = None
 
 
 @dataclass
@@ -85,13 +119,17 @@ class AgentState:
         dt: Temporal information of the agent.
         status: Infected state of the agent.
         pos: Current spatial position of the agent in the environment.
-        path: Current agent target path.
+        path: Current agent target path as flat cell indices.
+        cursor: Index of the next cell to move to along `path`.
+        wait: Number of time steps left to wait after `path` is completed.
     """
 
     dt: AgentTime | None
     status: AgentStatus | str | int = AgentStatus.UNKNOWN
     pos: tuple[int, int, int] = (0, 0, 0)
-    path: deque[tuple[int, int]] = field(default_factory=deque)
+    path: CellPath | None = None
+    cursor: int = 0
+    wait: int = 0
 
     @override
     def __post_init__(self) -> None:
@@ -117,3 +155,7 @@ class AgentSpec:
     def from_dict(cls, data: dict) -> AgentSpec:
         """Create an AgentSpec instance from a dictionary."""
         return dacite.from_dict(data_class=cls, data=data)
+
+    def copy(self, **info) -> AgentSpec:
+        """Copy an already validated specification with a fresh state, overriding `info` fields."""
+        return AgentSpec(info=replace(self.info, **info), state=replace(self.state, dt=AgentTime()))
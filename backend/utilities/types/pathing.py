@@ -1,8 +1,7 @@
 """Type definitions for pathing related structures."""
 
-from collections import deque
+import numpy as np
 
 Coordinate = tuple[int, int, int]
 type Edge[T: Coordinate | int] = tuple[T, T]
-PathSegment = list[Coordinate] | deque[Coordinate]
-ComputedPaths = dict[Coordinate, dict[Coordinate, PathSegment]]
+CellPath = np.typing.NDArray[np.int32]
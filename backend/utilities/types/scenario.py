@@ -2,7 +2,7 @@
 
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import override
+from typing import Literal, override
 
 import dacite
 import numpy as np
@@ -21,6 +21,8 @@ class VirusInfo:
         infection_rate: Infection rate of the virus.
         matrix: Matrix representing the virus spread.
         decay_factor: Decay factor for the virus.
+        precision: Data type of `matrix`, `uint16` storing concentrations rounded to whole units, both reduced
+            precisions rounded stochastically and saved as is in verbose frames.
     """
 
     name: str
@@ -28,6 +30,7 @@ class VirusInfo:
     infection_rate: float
     matrix: np.ndarray | None
     decay_factor: float | None
+    precision: Literal['float32', 'float16', 'uint16'] = 'float32'
 
 
 @dataclass
@@ -69,7 +72,20 @@ class SimSetup:
         save_resolution: Resolution for saving simulation data.
         save_verbose: Whether to save verbose simulation data.
         max_iter: Maximum number of iterations for the simulation.
-        masks: Dictionary of masks for different terrains.
+        vectorized: Whether to use the struct-of-arrays population backend.
+        ventilation_workers: Number of threads diffusing the floors in parallel.
+        ventilation_substeps: Number of time steps fused into each ventilation, `1` for exact ventilation.
+        ensemble: Number of replicates simulated together by the struct-of-arrays population backend.
+        checkpoint_interval: Number of saved iterations between checkpoints of the model, `0` to disable.
+        burn_in: Number of saved iterations simulated once and shared by every task of parallel runs.
+        path_cache_size: Maximum number of shortest paths cached by the grid graph pathfinder, `0` to disable.
+        navigation: How struct-of-arrays agents reach a random cell of their destination zones: along a path
+            to it, or down the distance field of the zone, then within the zone to the cell.
+        masks: Dictionary of masks for different terrains, emptied once compiled into `labels`.
+        zone_ids: Id of each terrain zone, including the derived `VALID` and `BARRIER` zones.
+        labels: Label of each cell, the distinct combinations of zones overlapping on the map.
+        label_zones: `(L, Z)` whether each label belongs to each zone.
+        mask_idxs: Coordinates of the cells of each zone.
     """
 
     name: str
@@ -81,6 +97,14 @@ class SimSetup:
     save_resolution: int = 60
     save_verbose: bool = False
     max_iter: int = 2500
+    vectorized: bool = False
+    ventilation_workers: int = 1
+    ventilation_substeps: int = 1
+    ensemble: int = 1
+    checkpoint_interval: int = 250
+    burn_in: int = 0
+    path_cache_size: int = 4096
+    navigation: Literal['paths', 'fields'] = 'paths'
     masks: dict[str, np.typing.NDArray[np.bool_]] = field(default_factory=dict)
 
     @override
@@ -89,6 +113,29 @@ class SimSetup:
         self._mask_terrains(img)
 
         self.mask_idxs = {k: np.argwhere(v) for k, v in self.masks.items()}
+        self._compile_labels()
+
+    def _compile_labels(self) -> None:
+        """Compile the terrain masks into a label raster and release them."""
+        self.zone_ids = {zone: i for i, zone in enumerate(self.masks)}
+        bits = np.packbits(np.stack(list(self.masks.values()), axis=-1), axis=-1)
+        combos, labels = np.unique(bits.reshape(-1, bits.shape[-1]), axis=0, return_inverse=True)
+        self.label_zones = np.unpackbits(combos, axis=-1, count=len(self.masks)).astype(bool)
+        self.labels = labels.astype(np.min_scalar_type(len(combos))).reshape(self.shape)
+        self.masks = {}
+
+    def zone_id(self, zone: str | None) -> int:
+        """Id of terrain `zone`, `-1` if undefined."""
+        return self.zone_ids.get(zone, -1)
+
+    def in_zone(self, zone: str | int, index: tuple | np.typing.NDArray) -> np.typing.NDArray[np.bool_]:
+        """Check whether the cells at `index` of the map belong to zone `zone` (name or id)."""
+        zone = self.zone_ids[zone] if isinstance(zone, str) else zone
+        return self.label_zones[self.labels[index], zone]
+
+    def mask(self, zone: str) -> np.typing.NDArray[np.bool_]:
+        """Full boolean mask of terrain `zone`, computed from the label raster."""
+        return self.label_zones[self.labels, self.zone_ids[zone]]
 
     def _load_mapfile(self) -> np.typing.NDArray:
         """Load the map file and optional transit nodes."""
@@ -178,7 +225,8 @@ class ScenarioSpec:
     def __post_init__(self) -> None:
         _steps = 3 * 60 * 60 // self.sim.t_step
         self.virus.decay_factor = 0.15 ** (1 / _steps)
-        self.virus.matrix = np.zeros(self.sim.shape, np.float32)
+        shape = self.sim.shape if self.sim.ensemble == 1 else (self.sim.ensemble, *self.sim.shape)
+        self.virus.matrix = np.zeros(shape, self.virus.precision)
 
     @classmethod
     def from_dict(cls, data: dict) -> 'ScenarioSpec':